@@ -1,12 +1,32 @@
 __all__ = [
     "RedBlackTree",
     "LinkedList",
+    "HashIndex",
+    "OrderArray",
+    "BACKENDS",
+    "iter_query",
+    "Event",
 ]
 
+from bisect import bisect_left, bisect_right
+from enum import IntEnum
+from fnmatch import fnmatchcase
+from itertools import chain
+
 BLACK = 0
 RED = 1
 
 
+class Event(IntEnum):
+    """
+    Kinds of the events of BlockPar.iter_events and CacheData.iter_events,
+    PARAM and BLOCK_START match the element kind bytes of the format
+    """
+    PARAM = 1
+    BLOCK_START = 2
+    BLOCK_END = 3
+
+
 class RedBlackTree:
     """
     :type _root: RedBlackTree.Node
@@ -28,23 +48,38 @@ class RedBlackTree:
             self.color = color
             self.next = None
             self.count = 1
+            # number of elements in the subtree, duplicates included
+            self.size = 1
 
         def __repr__(self):
             color = "Black" if self.color == BLACK else "Red"
             content = "None" if self.content is None else repr(self.content)
             return f"<{color}:{content}>"
 
+        def update_size(self):
+            self.size = self.count
+            if self.left is not None:
+                self.size += self.left.size
+            if self.right is not None:
+                self.size += self.right.size
+
         def replace(self, other):
             other.count = self.count
+            other.size = self.size
             other.parent = self.parent
             other.left = self.left
             other.right = self.right
             other.color = self.color
 
-            if self is self.parent.left:
-                self.parent.left = other
-            elif self is self.parent.right:
-                self.parent.right = other
+            if self.left is not None:
+                self.left.parent = other
+            if self.right is not None:
+                self.right.parent = other
+            if self.parent is not None:
+                if self is self.parent.left:
+                    self.parent.left = other
+                elif self is self.parent.right:
+                    self.parent.right = other
 
     def __init__(self):
         self._root = None
@@ -64,6 +99,8 @@ class RedBlackTree:
             node.parent.right = pivot
         pivot.left = node
         node.parent = pivot
+        pivot.size = node.size
+        node.update_size()
 
     def rotate_right(self, node):
         pivot = node.left
@@ -79,6 +116,8 @@ class RedBlackTree:
             node.parent.left = pivot
         pivot.right = node
         node.parent = pivot
+        pivot.size = node.size
+        node.update_size()
 
     def append(self, content):
         self.count += 1
@@ -91,6 +130,7 @@ class RedBlackTree:
         x = self._root
         while x is not None:
             y = x
+            x.size += 1
             if x.content.name > z.content.name:
                 x = x.left
             elif x.content.name < z.content.name:
@@ -110,6 +150,64 @@ class RedBlackTree:
             y.right = z
         self._append_repair(z)
 
+    def extend(self, contents):
+        """
+        Append contents. When the tree is empty and contents are sorted by
+        name, the tree is built directly in O(n): equal names become
+        duplicate chains in their given order.
+        """
+        contents = list(contents)
+        if self._root is not None or not contents:
+            for content in contents:
+                self.append(content)
+            return
+
+        heads = []
+        head = tail = None
+        for content in contents:
+            if head is not None and content.name == head.content.name:
+                node = RedBlackTree.Node(content, parent=head)
+                tail.next = node
+                tail = node
+                head.count += 1
+            elif head is not None and content.name < head.content.name:
+                # not sorted, fall back to one by one insertion
+                self._root = None
+                for content in contents:
+                    self.append(content)
+                return
+            else:
+                head = tail = RedBlackTree.Node(content, BLACK)
+                heads.append(head)
+
+        # with middle splits all leaves are on the last two levels,
+        # so coloring the last level red keeps black heights equal
+        red_depth = len(heads).bit_length() - 1
+        # starts[i]: number of elements before heads[i]
+        starts = [0] * (len(heads) + 1)
+        for i, head in enumerate(heads):
+            starts[i + 1] = starts[i] + head.count
+        stack = [(0, len(heads), None, 0, False)]
+        while stack:
+            lo, hi, parent, depth, is_right = stack.pop()
+            mid = (lo + hi) // 2
+            node = heads[mid]
+            node.parent = parent
+            node.color = RED if depth == red_depth else BLACK
+            node.size = starts[hi] - starts[lo]
+            if parent is None:
+                self._root = node
+            elif is_right:
+                parent.right = node
+            else:
+                parent.left = node
+            if lo < mid:
+                stack.append((lo, mid, node, depth + 1, False))
+            if mid + 1 < hi:
+                stack.append((mid + 1, hi, node, depth + 1, True))
+        self._root.color = BLACK
+        self.count = len(contents)
+
     def _append_repair(self, node):
         while (node is not self._root) and (node.parent.color == RED):
             grandparent = node.parent.parent
@@ -147,7 +245,7 @@ class RedBlackTree:
         x = self._root
         while x is not None:
             if name == x.content.name:
-                if index == -1 or x.count == 0:
+                if index == -1 or (index == 0 and x.count == 1):
                     self._remove(x)
                     return
                 if index < x.count:
@@ -166,7 +264,11 @@ class RedBlackTree:
                         x = cur
                     x.count -= 1
                     self.count -= 1
+                    while x is not None:
+                        x.size -= 1
+                        x = x.parent
                     return
+                return
             elif name < x.content.name:
                 x = x.left
             else:
@@ -184,18 +286,35 @@ class RedBlackTree:
         if (node.left is None) or (node.right is None):
             x = node
         else:
+            # move the elements of the successor into node
+            # and unlink the successor instead
             x = node.right
             while x.left is not None:
                 x = x.left
+            node.content = x.content
+            node.next = x.next
+            node.count = x.count
+            cur = node
+            for i in range(node.count - 1):
+                cur = cur.next
+                cur.parent = node
         y = x.left if x.left is not None else x.right
-        y.parent = x.parent
+        if y is None and x.color == BLACK:
+            # x itself stands for the missing child during the repair
+            self._remove_repair(x)
+        if y is not None:
+            y.parent = x.parent
         if x.parent is None:
             self._root = y
         elif x is x.parent.left:
             x.parent.left = y
         else:
             x.parent.right = y
-        if x.color == BLACK:
+        parent = x.parent
+        while parent is not None:
+            parent.update_size()
+            parent = parent.parent
+        if y is not None and x.color == BLACK:
             self._remove_repair(y)
 
     def _remove_repair(self, node):
@@ -245,7 +364,7 @@ class RedBlackTree:
                     sibling.color = node.parent.color
                     node.parent.color = BLACK
                     if sibling.left is not None:
-                        sibling.right.color = BLACK
+                        sibling.left.color = BLACK
                     self.rotate_right(node.parent)
                     node = self._root
         if node is not None:
@@ -311,6 +430,77 @@ class RedBlackTree:
                     cur = cur.next
                 node = node.right
 
+    def iter_from(self, name):
+        """Nodes with names not less than name in sorted order"""
+        stack = []
+        node = self._root
+        while node is not None:
+            if node.content.name < name:
+                node = node.right
+            else:
+                stack.append(node)
+                node = node.left
+        while stack:
+            node = stack.pop()
+            cur = node
+            for i in range(node.count):
+                yield cur
+                cur = cur.next
+            node = node.right
+            while node is not None:
+                stack.append(node)
+                node = node.left
+
+    def iter_prefix(self, prefix):
+        """Nodes with names starting with prefix in sorted order"""
+        for node in self.iter_from(prefix):
+            if not node.content.name.startswith(prefix):
+                return
+            yield node
+
+    def iter_range(self, lo, hi=None):
+        """Nodes with lo <= name < hi in sorted order"""
+        for node in self.iter_from(lo):
+            if hi is not None and not node.content.name < hi:
+                return
+            yield node
+
+    def iter_at(self, index):
+        """Nodes from position index on in sorted order"""
+        stack = []
+        skip = 0
+        node = self._root
+        while node is not None:
+            left = node.left.size if node.left is not None else 0
+            if index < left:
+                stack.append(node)
+                node = node.left
+            elif index < left + node.count:
+                stack.append(node)
+                skip = index - left
+                break
+            else:
+                index -= left + node.count
+                node = node.right
+        while stack:
+            node = stack.pop()
+            cur = node
+            for i in range(node.count):
+                if i >= skip:
+                    yield cur
+                cur = cur.next
+            skip = 0
+            node = node.right
+            while node is not None:
+                stack.append(node)
+                node = node.left
+
+    def select(self, index):
+        """Node at position index in sorted order"""
+        if not 0 <= index < self.count:
+            raise IndexError("RedBlackTree.select: index out of range")
+        return next(self.iter_at(index))
+
     def postorder_traverse(self):
         node = self._root
         stack = []
@@ -360,22 +550,23 @@ class LinkedList:
         counter = 0
         while cur is not None:
             if cur.content.name == name:
-                if counter != index:
-                    counter += 1
+                if index == -1 or counter == index:
+                    if prev is not None:
+                        prev.next = cur.next
+                        if cur.next is None:
+                            self.tail = prev
+                    else:
+                        self.head = cur.next
+                        if self.head is None:
+                            self.tail = None
+                    self.count -= 1
+                    if index != -1:
+                        return
+                    cur = cur.next
                     continue
-                if prev is not None:
-                    prev.next = cur.next
-                    if cur.next is None:
-                        self.tail = prev
-                else:
-                    self.head = self.head.next
-                    if self.head is None:
-                        self.tail = None
-                self.count -= 1
+                counter += 1
             prev = cur
             cur = cur.next
-            if index != -1:
-                return
 
     def remove_all(self, name):
         self.remove(name, -1)
@@ -388,3 +579,276 @@ class LinkedList:
         for i in range(self.count):
             yield cur
             cur = cur.next
+
+
+class HashIndex:
+    """
+    Search map with the RedBlackTree interface backed by a dict from name
+    to the chain of its duplicates. Lookups cost a single hash probe,
+    sorted iteration goes through a list of names which is built
+    on demand and dropped whenever a name is added or removed.
+    """
+    class Node:
+        __slots__ = ('content', 'next', 'count', 'last')
+
+        def __init__(self, content):
+            self.content = content
+            self.next = None
+            self.count = 1
+            self.last = self
+
+        def __repr__(self):
+            return f"<{self.content!r}>"
+
+    def __init__(self):
+        self._index = {}
+        self._names = None
+        # positions of the names in sorted order, duplicates included
+        self._starts = None
+        self.count = 0
+
+    def append(self, content):
+        self.count += 1
+        self._starts = None
+        node = HashIndex.Node(content)
+        head = self._index.get(content.name)
+        if head is None:
+            self._index[content.name] = node
+            self._names = None
+        else:
+            head.last.next = node
+            head.last = node
+            head.count += 1
+
+    def extend(self, contents):
+        for content in contents:
+            self.append(content)
+
+    def remove(self, name, index=0):
+        head = self._index.get(name)
+        if head is None or index >= head.count:
+            return
+        self._starts = None
+        if index == -1 or head.count == 1:
+            del self._index[name]
+            self._names = None
+            self.count -= head.count
+            return
+        if index == 0:
+            node = head.next
+            node.count = head.count - 1
+            node.last = head.last
+            self._index[name] = node
+        else:
+            prev = head
+            for i in range(index - 1):
+                prev = prev.next
+            cur = prev.next
+            prev.next = cur.next
+            if cur is head.last:
+                head.last = prev
+            head.count -= 1
+        self.count -= 1
+
+    def remove_all(self, name):
+        self.remove(name, -1)
+
+    def __contains__(self, name):
+        return name in self._index
+
+    def find(self, name):
+        return self._index.get(name)
+
+    def names(self):
+        """Names in sorted order"""
+        if self._names is None:
+            self._names = sorted(self._index)
+        return self._names
+
+    def __len__(self):
+        return self.count
+
+    def __iter__(self):
+        return self.iter_from('')
+
+    def iter_from(self, name):
+        """Nodes with names not less than name in sorted order"""
+        index = self._index
+        names = self.names()
+        for i in range(bisect_left(names, name), len(names)):
+            node = index.get(names[i])
+            while node is not None:
+                yield node
+                node = node.next
+
+    def iter_prefix(self, prefix):
+        """Nodes with names starting with prefix in sorted order"""
+        for node in self.iter_from(prefix):
+            if not node.content.name.startswith(prefix):
+                return
+            yield node
+
+    def iter_range(self, lo, hi=None):
+        """Nodes with lo <= name < hi in sorted order"""
+        for node in self.iter_from(lo):
+            if hi is not None and not node.content.name < hi:
+                return
+            yield node
+
+    def _get_starts(self):
+        if self._starts is None:
+            index = self._index
+            starts = [0] * len(self.names())
+            pos = 0
+            for i, name in enumerate(self._names):
+                starts[i] = pos
+                pos += index[name].count
+            self._starts = starts
+        return self._starts
+
+    def iter_at(self, index):
+        """Nodes from position index on in sorted order"""
+        index = max(index, 0)
+        if index >= self.count:
+            return
+        starts = self._get_starts()
+        names = self._names
+        i = bisect_right(starts, index) - 1
+        node = self._index[names[i]]
+        for j in range(index - starts[i]):
+            node = node.next
+        while True:
+            while node is not None:
+                yield node
+                node = node.next
+            i += 1
+            if i == len(names):
+                return
+            node = self._index.get(names[i])
+
+    def select(self, index):
+        """Node at position index in sorted order"""
+        if not 0 <= index < self.count:
+            raise IndexError("HashIndex.select: index out of range")
+        return next(self.iter_at(index))
+
+
+class OrderArray:
+    """
+    Insertion order map with the LinkedList interface backed by a list
+    """
+    class Node:
+        __slots__ = ('content',)
+
+        def __init__(self, content):
+            self.content = content
+
+    def __init__(self):
+        self._items = []
+
+    @property
+    def count(self):
+        return len(self._items)
+
+    def append(self, content):
+        self._items.append(OrderArray.Node(content))
+
+    def remove(self, name, index=0):
+        counter = 0
+        for i, node in enumerate(self._items):
+            if node.content.name == name:
+                if index == -1:
+                    break
+                if counter == index:
+                    del self._items[i]
+                    return
+                counter += 1
+        else:
+            return
+        self._items = [node for node in self._items
+                       if node.content.name != name]
+
+    def remove_all(self, name):
+        self.remove(name, -1)
+
+    def __len__(self):
+        return len(self._items)
+
+    def __iter__(self):
+        return iter(self._items)
+
+
+# (order map, search map) classes of the container backends
+BACKENDS = {
+    'tree': (LinkedList, RedBlackTree),
+    'hash': (OrderArray, HashIndex),
+}
+
+
+def _iter_matches(block, part, elements):
+    """Elements of block whose names match one segment of a query"""
+    if '*' not in part and '?' not in part and '[' not in part:
+        node = block._search_map.find(part)
+        if node is not None:
+            for i in range(node.count):
+                yield node.content
+                node = node.next
+    elif part == '*':
+        yield from elements(block)
+    elif (part.endswith('*') and '*' not in part[:-1]
+          and '?' not in part and '[' not in part):
+        for node in block._search_map.iter_prefix(part[:-1]):
+            yield node.content
+    else:
+        for el in elements(block):
+            if fnmatchcase(el.name, part):
+                yield el
+
+
+def iter_query(root, pattern, elements):
+    """
+    Yield (path, content) of the elements of a BlockPar-like tree matching
+    a dotted pattern. A segment is a name, a glob ('*' any name, 'Item*'
+    a prefix, '[ab]?' and the like) or '**' for any number of levels.
+    Names and prefixes are looked up in the search map, other globs scan
+    the block. elements(block) gives the elements of a block in order.
+    """
+    parts = []
+    for part in pattern.strip().split('.'):
+        if part != '**' or not parts or parts[-1] != '**':
+            parts.append(part)
+    last = len(parts)
+    # with several '**' an element can match in more than one way
+    seen = set() if parts.count('**') > 1 else None
+
+    def expand(block, path, k):
+        """(path, element, number of parts matched) of the next level"""
+        prefix = path + '.' if path else ''
+        part = parts[k]
+        if part != '**':
+            return ((prefix + el.name, el, k + 1)
+                    for el in _iter_matches(block, part, elements))
+        if k + 1 == last:
+            # everything below: the element itself, then its children
+            return ((prefix + el.name, el, j)
+                    for el in elements(block) for j in (last, k))
+        # zero levels, then one more level for '**' to take
+        return chain(expand(block, path, k + 1),
+                     ((prefix + el.name, el, k)
+                      for el in elements(block) if el.kind == 2))
+
+    stack = [expand(root, '', 0)]
+    while stack:
+        item = next(stack[-1], None)
+        if item is None:
+            stack.pop()
+            continue
+        path, el, k = item
+        if k == last:
+            if seen is not None:
+                if id(el) in seen:
+                    continue
+                seen.add(id(el))
+            yield path, el.content
+        elif el.kind == 2:  # ElementKind.BLOCK
+            stack.append(expand(el.content, path, k))
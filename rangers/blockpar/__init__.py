@@ -1 +1,2 @@
 from ._blockpar import *
+from ._frozen import *
@@ -1,16 +1,64 @@
 __all__ = [
     "BlockPar",
+    "PathIndex",
+    "IncludeResolver",
+    "Event",
 ]
 
+from concurrent.futures import ThreadPoolExecutor
 from enum import IntEnum
-from typing import Union, List, TextIO
+from io import BytesIO
+from itertools import islice
+import os
+import re
+from struct import Struct
+from typing import (Union, Callable, Dict, Iterable, Iterator, List,
+                    Optional, TextIO, Tuple)
+import threading
 import warnings
 
 from rangers._blockpar_helper import *
-from rangers.io import AbstractIO, Buffer
+from rangers.io import (AbstractIO, Buffer, MappedBuffer, ChunkStream,
+                        iter_dat, write_dat, DAT_CHUNK_SIZE)
+from rangers.io._io import _find_widestr_end
 from rangers.common import bytes_xor, bytes_to_int
 
 
+_uint = Struct('<I')
+
+# default of get_many, missing paths come back as exceptions
+_missing = object()
+
+# line breaks known to str.splitlines but not to text files
+# read with newline=''
+_extra_line_breaks = re.compile('[\x0b\x0c\x1c\x1d\x1e\x85\u2028\u2029]')
+_line = re.compile('[^\r\n]*(?:\r\n|\r|\n)|[^\r\n]+')
+# path of `name=path {` lines, used to read included files ahead
+_include = re.compile(r'[\t ]*[^\r\n={/]*=[\t ]*([^\r\n{]*?)[\t ]*[\^~]?'
+                      r'[\t ]*\{')
+# finds every include line of a text, and maybe a few other lines
+_maybe_include = re.compile(r'=[^\r\n{]*\{')
+
+
+def _empty_body(lines: List[str], i: int) -> bool:
+    """Whether the block opened before lines[i] gets no elements"""
+    for line in islice(lines, i, None):
+        if '//' in line:
+            line = line.split('//', 1)[0]
+        if '{' in line or '=' in line:
+            return False
+        if '}' in line:
+            return True
+    return True
+
+
+def _split_lines(text: str) -> List[str]:
+    """Lines of text with their line breaks, as readline would give them"""
+    if _extra_line_breaks.search(text) is None:
+        return text.splitlines(keepends=True)
+    return _line.findall(text)
+
+
 class ElementKind(IntEnum):
     UNDEF = 0
     PARAM = 1
@@ -37,12 +85,188 @@ class BlockParElement:
         return f"<\"{self.name}\">"
 
 
-class BlockPar:
+def _get_widestr(data: Union[bytes, bytearray], pos: int,
+                 decode: Optional[Callable[[bytes], str]] = None):
+    """
+    Decode the widestr at pos, return it with the position after it.
+    decode: decoder of the raw bytes, e.g. WidestrCache.decode
+    """
+    end = _find_widestr_end(data, pos, pos)
+    if end < 0:
+        raise ValueError("BlockPar: unexpected end of data")
+    if decode is not None:
+        return decode(bytes(data[pos:end])), end + 2
+    return data[pos:end].decode('utf-16le'), end + 2
+
+
+def _skip_widestr(data: Union[bytes, bytearray], pos: int) -> int:
+    end = _find_widestr_end(data, pos, pos)
+    if end < 0:
+        raise ValueError("BlockPar: unexpected end of data")
+    return end + 2
+
+
+def _skip_block(data: Union[bytes, bytearray], pos: int,
+                new_format: bool) -> int:
+    """
+    Position after the serialized block starting at pos,
+    strings are scanned but not decoded
+    """
+    skip = 8 if new_format and data[pos] == 1 else 0
+    left, = _uint.unpack_from(data, pos + 1)
+    pos += 5
+
+    stack = list()
+
+    while True:
+        if left > 0:
+            pos += skip
+            kind = data[pos]
+            pos = _skip_widestr(data, pos + 1)
+            if kind == 1:  # ElementKind.PARAM
+                pos = _skip_widestr(data, pos)
+                left -= 1
+            elif kind == 2:  # ElementKind.BLOCK
+                stack.append((left, skip))
+                skip = 8 if new_format and data[pos] == 1 else 0
+                left, = _uint.unpack_from(data, pos + 1)
+                pos += 5
+            else:
+                raise ValueError("BlockPar: unknown element")
+        elif stack:
+            left, skip = stack.pop()
+            left -= 1
+        else:
+            return pos
+
+
+def _iter_events_bytes(data: Union[bytes, bytearray], new_format: bool
+                       ) -> Iterator[Tuple[Event, str,
+                                           Union[str, bool, None]]]:
+    """BlockPar.iter_events over the serialized data in memory"""
+    get_widestr = _get_widestr
+    unpack_uint = _uint.unpack_from
+    cache = AbstractIO.widestr_cache
+    decode = cache.decode if cache is not None else None
+    PARAM = Event.PARAM
+    BLOCK_START = Event.BLOCK_START
+    BLOCK_END = Event.BLOCK_END
+
+    sort = data[0] == 1
+    left, = unpack_uint(data, 1)
+    pos = 5
+    skip = 8 if new_format and sort else 0
+    name = None
+
+    stack = list()
+
+    while True:
+        if left > 0:
+            pos += skip
+            kind = data[pos]
+            el_name, pos = get_widestr(data, pos + 1, decode)
+
+            if kind == 1:  # ElementKind.PARAM
+                value, pos = get_widestr(data, pos, decode)
+                yield PARAM, el_name, value
+                left -= 1
+
+            elif kind == 2:  # ElementKind.BLOCK
+                stack.append((name, left, skip))
+                name = el_name
+                sort = data[pos] == 1
+                left, = unpack_uint(data, pos + 1)
+                pos += 5
+                skip = 8 if new_format and sort else 0
+                yield BLOCK_START, name, sort
 
-    def __init__(self, sort: bool = True):
-        self._order_map = LinkedList()
-        self._search_map = RedBlackTree()
+            else:
+                raise ValueError("BlockPar.iter_events: unknown element")
+
+        else:
+            if not stack:
+                break
+            yield BLOCK_END, name, None
+            name, left, skip = stack.pop()
+            left -= 1
+
+
+class BlockPar:
+    # container backend of new blocks, one of BACKENDS:
+    # 'tree' keeps elements in a red-black tree, 'hash' in a dict
+    backend = 'tree'
+    # bumped by every change of any block, invalidates path indexes
+    _generation = 0
+
+    def __init__(self, sort: bool = True, *, backend: Optional[str] = None):
+        if backend is not None:
+            self.backend = backend
+        if self.backend not in BACKENDS:
+            raise ValueError(f"BlockPar: unknown backend {self.backend}")
+        order_type, search_type = BACKENDS[self.backend]
+        self._order = order_type()
+        self._search = search_type()
         self.sorted = sort
+        # (data, position, new_format) of a block not decoded yet
+        self._lazy = None
+        # set to a PathIndex to cache get_par and get_block lookups
+        self.path_index = None  # type: Optional[PathIndex]
+
+    @property
+    def _order_map(self) -> Union[LinkedList, OrderArray]:
+        if self._lazy is not None:
+            self._materialize()
+        return self._order
+
+    @property
+    def _search_map(self) -> Union[RedBlackTree, HashIndex]:
+        if self._lazy is not None:
+            self._materialize()
+        return self._search
+
+    def _materialize(self):
+        data, pos, new_format = self._lazy
+        self._lazy = None
+        # decoding does not change the content, keep path indexes valid
+        generation = BlockPar._generation
+        self._load_level(data, pos, new_format)
+        BlockPar._generation = generation
+
+    def _load_level(self, data: Union[bytes, bytearray], pos: int,
+                    new_format: bool):
+        """
+        Decode the direct elements of the block serialized at pos,
+        sub-blocks only record their position and are decoded
+        on first access
+        """
+        self.sorted = data[pos] == 1
+        skip = 8 if new_format and self.sorted else 0
+        left, = _uint.unpack_from(data, pos + 1)
+        pos += 5
+        items = []
+        cache = AbstractIO.widestr_cache
+        decode = cache.decode if cache is not None else None
+
+        for i in range(left):
+            pos += skip
+            kind = data[pos]
+            name, pos = _get_widestr(data, pos + 1, decode)
+
+            if kind == 1:  # ElementKind.PARAM
+                value, pos = _get_widestr(data, pos, decode)
+                items.append((name, value))
+
+            elif kind == 2:  # ElementKind.BLOCK
+                block = BlockPar(backend=self.backend)
+                block.sorted = data[pos] == 1
+                block._lazy = (data, pos, new_format)
+                pos = _skip_block(data, pos, new_format)
+                items.append((name, block))
+
+            else:
+                raise ValueError("BlockPar.load_bytes: unknown element")
+
+        self.extend(items)
 
     def __setitem__(self, key: str, value: Union[str, 'BlockPar']):
         warnings.warn("Mapping interface is deprecated, "
@@ -78,11 +302,25 @@ class BlockPar:
         pass
 
     def add(self, key: str, value: Union[str, 'BlockPar']):
+        BlockPar._generation += 1
         elem = BlockParElement(key, value)
         self._order_map.append(elem)
         self._search_map.append(elem)
 
+    def extend(self, items: Iterable[Tuple[str, Union[str, 'BlockPar']]]):
+        """
+        Add (key, value) pairs in order. Pairs sorted by key are put into
+        an empty block in linear time.
+        """
+        BlockPar._generation += 1
+        elems = [BlockParElement(key, value) for key, value in items]
+        order_append = self._order_map.append
+        for elem in elems:
+            order_append(elem)
+        self._search_map.extend(elems)
+
     def set(self, key: str, value: Union[str, 'BlockPar']):
+        BlockPar._generation += 1
         self._order_map.remove_all(key)
         self._search_map.remove_all(key)
         elem = BlockParElement(key, value)
@@ -185,6 +423,7 @@ class BlockPar:
 
         curblock = self
         curblock.sorted = s.get_bool()
+        items = []
 
         left = s.get_uint()
 
@@ -200,15 +439,15 @@ class BlockPar:
                 name = s.get_widestr()
 
                 if type == ElementKind.PARAM:
-                    curblock.add(name, s.get_widestr())
+                    items.append((name, s.get_widestr()))
                     left -= 1
 
                 elif type == ElementKind.BLOCK:
-                    stack.append((curblock, left))
+                    stack.append((curblock, left, items))
 
-                    prevblock = curblock
-                    curblock = BlockPar()
-                    prevblock.add(name, curblock)
+                    curblock = BlockPar(backend=self.backend)
+                    items.append((name, curblock))
+                    items = []
 
                     curblock.sorted = s.get_bool()
                     left = s.get_uint()
@@ -216,11 +455,132 @@ class BlockPar:
                     continue
 
             else:
+                # elements of sorted blocks come in key order,
+                # so extend builds the search tree in linear time
+                curblock.extend(items)
                 if level > 0:
-                    curblock, left = stack.pop()
+                    curblock, left, items = stack.pop()
                     left -= 1
                 level -= 1
 
+    def load_bytes(self, data: Union[bytes, bytearray, memoryview], *,
+                   new_format: bool = False, lazy: bool = False):
+        """
+        Fast variant of load: walks the serialized data with a local cursor
+        instead of reading it through AbstractIO and builds the blocks
+        directly. load is kept as the reference implementation.
+        lazy: only skim sub-blocks, each one is decoded when first accessed
+        """
+        self.clear()
+
+        if not isinstance(data, (bytes, bytearray)):
+            data = bytes(data)
+
+        self._lazy = None
+        if lazy:
+            self._load_level(data, 0, new_format)
+            return
+
+        get_widestr = _get_widestr
+        unpack_uint = _uint.unpack_from
+        cache = AbstractIO.widestr_cache
+        decode = cache.decode if cache is not None else None
+
+        curblock = self
+        curblock.sorted = data[0] == 1
+        left, = unpack_uint(data, 1)
+        pos = 5
+        skip = 8 if new_format and curblock.sorted else 0
+        items = []
+
+        stack = list()
+
+        while True:
+            if left > 0:
+                pos += skip
+                kind = data[pos]
+                name, pos = get_widestr(data, pos + 1, decode)
+
+                if kind == 1:  # ElementKind.PARAM
+                    value, pos = get_widestr(data, pos, decode)
+                    items.append((name, value))
+                    left -= 1
+
+                elif kind == 2:  # ElementKind.BLOCK
+                    stack.append((curblock, left, skip, items))
+
+                    curblock = BlockPar(backend=self.backend)
+                    items.append((name, curblock))
+                    items = []
+
+                    curblock.sorted = data[pos] == 1
+                    left, = unpack_uint(data, pos + 1)
+                    pos += 5
+                    skip = 8 if new_format and curblock.sorted else 0
+
+                else:
+                    raise ValueError("BlockPar.load_bytes: unknown element")
+
+            else:
+                curblock.extend(items)
+                if not stack:
+                    break
+                curblock, left, skip, items = stack.pop()
+                left -= 1
+
+    @staticmethod
+    def iter_events(source: Union[AbstractIO, bytes, bytearray, memoryview],
+                    *, new_format: bool = False
+                    ) -> Iterator[Tuple[Event, str, Union[str, bool, None]]]:
+        """
+        Walk the data read by load without building blocks, yields
+        (Event.BLOCK_START, name, sorted), (Event.PARAM, name, value) and
+        (Event.BLOCK_END, name, None) in file order. The root block has
+        no events of its own. An AbstractIO source is read as the events
+        are taken, so a ChunkStream keeps memory bounded by its chunks.
+        """
+        if not isinstance(source, AbstractIO):
+            if not isinstance(source, (bytes, bytearray)):
+                source = bytes(source)
+            yield from _iter_events_bytes(source, new_format)
+            return
+
+        s = source
+        sort = s.get_bool()
+        left = s.get_uint()
+        name = None
+
+        stack = list()
+
+        while True:
+            if left > 0:
+                if new_format and sort:
+                    s.get(8)
+
+                kind = s.get_byte()
+                el_name = s.get_widestr()
+
+                if kind == ElementKind.PARAM:
+                    yield Event.PARAM, el_name, s.get_widestr()
+                    left -= 1
+
+                elif kind == ElementKind.BLOCK:
+                    stack.append((name, left, sort))
+                    name = el_name
+                    sort = s.get_bool()
+                    left = s.get_uint()
+                    yield Event.BLOCK_START, name, sort
+
+                else:
+                    raise ValueError("BlockPar.iter_events: unknown element")
+
+            else:
+                if not stack:
+                    break
+                yield Event.BLOCK_END, name, None
+                name, left, sort = stack.pop()
+                left -= 1
+
     def load_txt(self, f: TextIO):
         self.clear()
 
@@ -250,29 +610,32 @@ class BlockPar:
                 head = line.split('{', 1)[0]
                 head = head.rstrip('\x09\x20')  # \t\s
 
+                # the marker belongs to the block being opened
+                sort = True
                 if head.endswith(('^', '~')):
-                    curblock.sorted = head.endswith('^')
+                    sort = head.endswith('^')
                     head = head[:-1]
                     head = head.rstrip('\x09\x20')  # \t\s
-                else:
-                    curblock.sorted = True
 
                 path = ''
                 if '=' in head:
-                    name, path = line.split('=', 1)
+                    name, path = head.split('=', 1)
                     name = name.rstrip('\x09\x20')  # \t\s
                     path = path.lstrip('\x09\x20')  # \t\s
                 else:
                     name = head
 
+                prevblock = curblock
                 if path != '':
-                    curblock[name] = BlockPar.from_txt(path)
+                    # the block content comes from the included file
+                    curblock = BlockPar.from_txt(path)
+                    prevblock.set(name, curblock)
                 else:
-                    prevblock = curblock
-                    curblock = BlockPar()
+                    curblock = BlockPar(backend=self.backend)
                     prevblock.add(name, curblock)
+                curblock.sorted = sort
 
-                    level += 1
+                level += 1
 
             elif '}' in line:
                 if level > 0:
@@ -314,7 +677,145 @@ class BlockPar:
             else:
                 continue
 
+    def load_txt_str(self, text: str, *, path: Optional[str] = None,
+                     resolver: Optional['IncludeResolver'] = None):
+        """
+        Fast variant of load_txt: parses the whole decoded text at once,
+        collects the elements of every block and adds them when the block
+        is closed. load_txt is kept as the reference implementation.
+
+        path: file the text comes from, the resolver looks up relative
+        includes next to it
+        resolver: IncludeResolver loading the included files,
+        BlockPar.from_txt is called for every include by default
+        """
+        self.clear()
+
+        lines = _split_lines(text)
+        count = len(lines)
+        i = 0
+
+        if resolver is not None:
+            matches = (_include.match(line) for line in lines if '{' in line)
+            resolver.prefetch((m.group(1) for m in matches if m is not None),
+                              path)
+
+        curblock = self
+        items = []
+
+        level = 0
+        stack = list()
+
+        while i < count:
+            line = lines[i].strip('\x09\x0a\x0d\x20')  # \t\n\r\s
+            i += 1
+
+            if '//' in line:
+                line = line.split('//', 1)[0]
+                line = line.rstrip('\x09\x20')  # \t\s
+
+            if '{' in line:
+                head = line.split('{', 1)[0]
+                head = head.rstrip('\x09\x20')  # \t\s
+
+                sort = True
+                if head.endswith(('^', '~')):
+                    sort = head.endswith('^')
+                    head = head[:-1]
+                    head = head.rstrip('\x09\x20')  # \t\s
+
+                include = ''
+                if '=' in head:
+                    name, include = head.split('=', 1)
+                    name = name.rstrip('\x09\x20')  # \t\s
+                    include = include.lstrip('\x09\x20')  # \t\s
+                else:
+                    name = head
+
+                if include != '':
+                    # set replaces the elements collected so far
+                    curblock.extend(items)
+                    items = []
+                    if resolver is None:
+                        block = BlockPar.from_txt(include)
+                    else:
+                        block = resolver.load(include, path)
+                        # a shared block is never changed, a sort marker
+                        # or elements of its own go into a copy
+                        if resolver.share and (block.sorted != sort or
+                                               not _empty_body(lines, i)):
+                            block = _copy_blockpar(block)
+                    if block.sorted != sort:
+                        block.sorted = sort
+                    curblock.set(name, block)
+                else:
+                    block = BlockPar(sort, backend=self.backend)
+                    items.append((name, block))
+
+                stack.append((curblock, items))
+                curblock = block
+                items = []
+                level += 1
+
+            elif '}' in line:
+                if level > 0:
+                    curblock.extend(items)
+                    curblock, items = stack.pop()
+                level -= 1
+
+            elif '=' in line:
+                name, value = line.split('=', 1)
+                name = name.rstrip('\x09\x20')  # \t\s
+                value = value.lstrip('\x09\x20')  # \t\s
+
+                # multiline parameters - heredoc
+                if value.startswith('<<<'):
+                    parts = []
+                    spacenum = 0
+                    while True:
+                        if i == count:
+                            raise Exception("BlockPar.load_txt_str: "
+                                            "heredoc end marker not found")
+                        line = lines[i]
+                        i += 1
+
+                        if line.strip('\x09\x0a\x0d\x20') == '':
+                            continue
+
+                        if not parts:
+                            spacenum = len(line) - len(line.lstrip('\x20'))
+                            if spacenum > (4 * level):
+                                spacenum = 4 * level
+
+                        if line.lstrip('\x09\x20').startswith('>>>'):
+                            value = ''.join(parts).rstrip('\x0a\x0d')
+                            break
+
+                        parts.append(line[spacenum:])
+
+                items.append((name, value))
+
+        # blocks left open at the end of the text
+        curblock.extend(items)
+        while stack:
+            curblock, items = stack.pop()
+            curblock.extend(items)
+
     def save_txt(self, f: TextIO):
+        for chunk in self.iter_txt():
+            f.write(chunk)
+
+    def iter_txt(self, chunk_size: int = 1 << 16) -> Iterator[str]:
+        """
+        Text written by save_txt, rendered line by line and given out
+        in pieces of at least chunk_size characters, the last one shorter
+        """
+        parts = []
+        append = parts.append
+        size = 0
+        PARAM = ElementKind.PARAM
+        BLOCK = ElementKind.BLOCK
+
         is_sort = self.sorted
         if is_sort:
             curblock = self._search_map.__iter__()
@@ -323,33 +824,26 @@ class BlockPar:
         left = len(self)
 
         level = 0
+        indent = ''  # 4 spaces level padding
         stack = list()
 
-        while level > -1:
+        while True:
             if left > 0:
                 node = next(curblock)
                 el = node.content
-                f.write(4 * '\x20' * level)
 
-                if el.kind == ElementKind.PARAM:
-                    f.write(el.name)
-                    f.write('=')
-                    if '\x0d' in el.content or '\x0a' in el.content:
-                        f.write('<<<')
-                        f.write('\x0d\x0a')
-                        content = el.content
-                        for s in content.splitlines(keepends=True):
-                            f.write(4 * '\x20' * level)
-                            f.write(s)
-                        f.write('\x0d\x0a')
-                        f.write(4 * '\x20' * level)
-                        f.write('>>>')
+                if el.kind == PARAM:
+                    content = el.content
+                    if '\x0d' in content or '\x0a' in content:
+                        lines = content.splitlines(keepends=True)
+                        line = (f'{indent}{el.name}=<<<\x0d\x0a'
+                                f'{indent}{indent.join(lines)}\x0d\x0a'
+                                f'{indent}>>>\x0d\x0a')
                     else:
-                        f.write(el.content)
-                    f.write('\x0d\x0a')
+                        line = f'{indent}{el.name}={content}\x0d\x0a'
                     left -= 1
 
-                elif el.kind == ElementKind.BLOCK:
+                elif el.kind == BLOCK:
                     stack.append((curblock, left))
 
                     is_sort = el.content.sorted
@@ -359,79 +853,206 @@ class BlockPar:
                         curblock = el.content._order_map.__iter__()
                     left = len(el.content)
 
-                    f.write(el.name)
-                    f.write('\x20')  # space
-                    if el.content.sorted:
-                        f.write('^')
-                    else:
-                        f.write('~')
-                    f.write('{')
-                    f.write('\x0d\x0a')  # \r\n
+                    marker = '^' if is_sort else '~'
+                    line = f'{indent}{el.name} {marker}{{\x0d\x0a'
                     level += 1
-                    continue
+                    indent = 4 * '\x20' * level
 
                 else:
-                    f.write('\x0d\x0a')
+                    line = f'{indent}\x0d\x0a'
+                    left -= 1
             else:
                 level -= 1
-                if level > -1:
-                    f.write(4 * '\x20' * level)  # 4 spaces level padding
-                    f.write('}')
-                    f.write('\x0d\x0a')  # \r\n
-                    curblock, left = stack.pop()
-                    left -= 1
-
-    def get_par(self, path: str) -> str:
-        path = path.strip().split('.')
+                if level < 0:
+                    break
+                indent = 4 * '\x20' * level
+                line = f'{indent}}}\x0d\x0a'
+                curblock, left = stack.pop()
+                left -= 1
+
+            append(line)
+            size += len(line)
+            if size >= chunk_size:
+                yield ''.join(parts)
+                parts.clear()
+                size = 0
+
+        if parts:
+            yield ''.join(parts)
+
+    def _find_path(self, path: str) -> BlockParElement:
+        index = self.path_index
+        if index is not None:
+            el = index.get(path)
+            if el is not None:
+                return el
+
+        parts = path.strip().split('.')
 
         curblock = self
-        for part in path:
-            el = curblock._search_map.find(part)
-            if el is None:
+        for part in parts[:-1]:
+            node = curblock._search_map.find(part)
+            if node is None or node.content.kind is not ElementKind.BLOCK:
                 raise Exception("BlockPar.get_par: path not exists")
-            if part != path[-1]:
-                if el.content.kind is not ElementKind.BLOCK:
-                    raise Exception("BlockPar.get_par: path not exists")
-                curblock = el.content.content
-            else:
-                if el.content.kind is not ElementKind.PARAM:
-                    raise Exception("BlockPar.get_par: not a parameter")
-                return el.content.content
+            curblock = node.content.content
+        node = curblock._search_map.find(parts[-1])
+        if node is None:
+            raise Exception("BlockPar.get_par: path not exists")
 
-    def get_block(self, path: str) -> 'BlockPar':
-        path = path.strip().split('.')
+        if index is not None:
+            index.put(path, node.content)
+        return node.content
 
-        curblock = self
-        for part in path:
-            el = curblock._search_map.find(part)
-            if el is None:
-                raise Exception("BlockPar.get_par: path not exists")
-            if part != path[-1]:
-                if el.content.kind is not ElementKind.BLOCK:
-                    raise Exception("BlockPar.get_par: path not exists")
-                curblock = el.content.content
+    def get_par(self, path: str) -> str:
+        el = self._find_path(path)
+        if el.kind is not ElementKind.PARAM:
+            raise Exception("BlockPar.get_par: not a parameter")
+        return el.content
+
+    def get_block(self, path: str) -> 'BlockPar':
+        el = self._find_path(path)
+        if el.kind is not ElementKind.BLOCK:
+            raise Exception("BlockPar.get_par: not a block")
+        return el.content
+
+    def get_at(self, index: int) -> Tuple[str, Union[str, 'BlockPar']]:
+        """
+        Name and value of the element at position index in key order,
+        negative indexes count from the end
+        """
+        if index < 0:
+            index += len(self)
+        el = self._search_map.select(index).content
+        return el.name, el.content
+
+    def slice(self, start: Optional[int] = None, stop: Optional[int] = None
+              ) -> List[Tuple[str, Union[str, 'BlockPar']]]:
+        """(name, value) of the elements start:stop in key order"""
+        start, stop, step = slice(start, stop).indices(len(self))
+        return [(node.content.name, node.content.content)
+                for node in islice(self._search_map.iter_at(start),
+                                   max(stop - start, 0))]
+
+    def iter_range(self, lo: str, hi: Optional[str] = None
+                   ) -> Iterator[Tuple[str, Union[str, 'BlockPar']]]:
+        """(name, value) of the elements with lo <= name < hi in key order"""
+        for node in self._search_map.iter_range(lo, hi):
+            yield node.content.name, node.content.content
+
+    def iter_prefix(self, prefix: str
+                    ) -> Iterator[Tuple[str, Union[str, 'BlockPar']]]:
+        """(name, value) of the elements with names starting with prefix"""
+        for node in self._search_map.iter_prefix(prefix):
+            yield node.content.name, node.content.content
+
+    def get_many(self, paths: Iterable[str],
+                 default=_missing) -> List[Union[str, 'BlockPar', Exception]]:
+        """
+        Resolve many dotted paths at once, values come back in the order
+        of paths. Parent paths are resolved once and remembered, each one
+        from its own parent, so blocks shared by several paths are
+        searched only once.
+        Missing paths get default if given, an Exception instance otherwise.
+        """
+        # resolved parent paths, the root is None, missing blocks are None
+        blocks = {None: self}
+
+        def resolve(path):
+            parent, sep, name = path.rpartition('.')
+            parent = parent if sep else None
+            block = blocks.get(parent, _missing)
+            if block is _missing:
+                block = resolve(parent)
+            if block is not None:
+                node = block._search_map.find(name)
+                if node is not None and node.content.kind is ElementKind.BLOCK:
+                    block = node.content.content
+                else:
+                    block = None
+            blocks[path] = block
+            return block
+
+        result = []
+        append = result.append
+        for path in paths:
+            parent, sep, name = path.strip().rpartition('.')
+            parent = parent if sep else None
+            block = blocks.get(parent, _missing)
+            if block is _missing:
+                block = resolve(parent)
+            node = block._search_map.find(name) if block is not None else None
+            if node is not None:
+                append(node.content.content)
+            elif default is _missing:
+                append(Exception("BlockPar.get_many: path not exists"))
             else:
-                if el.content.kind is not ElementKind.BLOCK:
-                    raise Exception("BlockPar.get_par: not a block")
-                return el.content.content
+                append(default)
+        return result
+
+    def query(self, pattern: str
+              ) -> Iterator[Tuple[str, Union[str, 'BlockPar']]]:
+        """
+        Lazily yield (path, value) of every element matching a dotted
+        pattern, e.g. 'Ships.*.Weapons.*.Damage', 'Lang.Item*.Name' or
+        '**.Name'. Segments are names, globs ('*', 'Item*', '[ab]?') or
+        '**' for any number of levels. Names and prefixes are found with
+        range scans of the search tree, '*' lists sorted blocks in key
+        order and others in insertion order.
+        """
+        def elements(block):
+            src = block._search_map if block.sorted else block._order_map
+            for node in src:
+                yield node.content
+
+        return iter_query(self, pattern, elements)
 
     def to_txt(self, path: str, encoding: str = 'cp1251'):
         with open(path, 'wt', encoding=encoding, newline='') as txt:
             self.save_txt(txt)
 
     @classmethod
-    def from_txt(cls, path: str, encoding: str = 'cp1251') -> 'BlockPar':
+    def from_txt(cls, path: str, encoding: str = 'cp1251', *,
+                 resolver: Optional['IncludeResolver'] = None
+                 ) -> 'BlockPar':
+        """
+        resolver: IncludeResolver loading the included files, by default
+        a new one serving the includes of this file only, created when
+        the file has include lines
+        """
         blockpar = cls()
         with open(path, 'rt', encoding=encoding, newline='') as txt:
-            blockpar.load_txt(txt)
+            text = txt.read()
+        if resolver is None and _maybe_include.search(text) is not None:
+            with IncludeResolver(encoding=encoding) as resolver:
+                blockpar.load_txt_str(text, path=path, resolver=resolver)
+        else:
+            blockpar.load_txt_str(text, path=path, resolver=resolver)
         return blockpar
 
     @classmethod
-    def from_dat(cls, path: str) -> 'BlockPar':
+    def from_dat(cls, path: str, *, streaming: bool = False,
+                 lazy: bool = False,
+                 chunk_size: int = DAT_CHUNK_SIZE) -> 'BlockPar':
+        """
+        streaming: decipher, hash and inflate the file chunk by chunk while
+        parsing, peak memory then depends on chunk_size, not on the file size
+        lazy: decode sub-blocks on first access, see load_bytes
+        """
         blockpar = None
         seed_key = b'\x89\xc6\xe8\xb1'
 
-        b = Buffer.from_file(path)
+        if streaming and lazy:
+            raise ValueError("BlockPar.from_dat: lazy loading "
+                             "needs the whole payload")
+
+        if streaming:
+            with ChunkStream(iter_dat(path, seed_key, chunk_size)) as s:
+                blockpar = cls()
+                blockpar.load(s, new_format=True)
+                s.drain()
+            return blockpar
+
+        b = MappedBuffer.from_file(path, copy_on_write=True)
 
         content_hash = b.get_uint()
 
@@ -444,14 +1065,250 @@ class BlockPar:
         calc_hash = b.calc_hash(size)
 
         if calc_hash == content_hash:
-            unpacked = Buffer.from_bytes(b.decompress(size))
+            unpacked = b.decompress(size)
             b.close()
             blockpar = cls()
-            blockpar.load(unpacked, new_format=True)
-            unpacked.close()
+            blockpar.load_bytes(unpacked, new_format=True, lazy=lazy)
         else:
             b.close()
             raise Exception("BlockPar.from_dat: wrong content hash")
 
         return blockpar
 
+    @staticmethod
+    def iter_dat_events(path: str, *, chunk_size: int = DAT_CHUNK_SIZE
+                        ) -> Iterator[Tuple[Event, str,
+                                            Union[str, bool, None]]]:
+        """
+        iter_events over a .dat file deciphered and inflated chunk by
+        chunk, the content hash is verified after the last event
+        """
+        seed_key = b'\x89\xc6\xe8\xb1'
+
+        with ChunkStream(iter_dat(path, seed_key, chunk_size)) as s:
+            yield from BlockPar.iter_events(s, new_format=True)
+            s.drain()
+
+    def to_dat(self, path: str, seed: Optional[int] = None, *,
+               level: int = 6, workers: Optional[int] = None):
+        """
+        Inverse of from_dat: serializes, compresses (ZL03), hashes and
+        enciphers the data, streaming every chunk into the file.
+        seed: cipher seed, random by default
+        """
+        seed_key = b'\x89\xc6\xe8\xb1'
+
+        b = Buffer(BytesIO())
+        self.save(b, new_format=True)
+        b.seek(0)
+        write_dat(path, b, seed_key, seed, level=level, workers=workers)
+        b.close()
+
+
+class PathIndex:
+    """
+    Cache of BlockPar.get_par and get_block lookups mapping dotted paths
+    to elements. A block does not know its parents, so any change of any
+    block drops the whole index and it fills again on the next lookups.
+    """
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self._entries = {}
+        self._generation = BlockPar._generation
+
+    def __len__(self):
+        return len(self._entries)
+
+    def clear(self):
+        self._entries.clear()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def get(self, path: str) -> Optional[BlockParElement]:
+        if self._generation != BlockPar._generation:
+            self._generation = BlockPar._generation
+            if self._entries:
+                self._entries.clear()
+                self.invalidations += 1
+        el = self._entries.get(path)
+        if el is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return el
+
+    def put(self, path: str, el: BlockParElement):
+        if self._generation == BlockPar._generation:
+            self._entries[path] = el
+
+
+def _copy_blockpar(bp: BlockPar) -> BlockPar:
+    """
+    Copy of the blocks of bp. Parameter elements are never changed in
+    place, so the copy shares them and only block elements are new.
+    """
+    result = BlockPar(bp.sorted, backend=bp.backend)
+    stack = [(bp, result)]
+    while stack:
+        src, dst = stack.pop()
+        copies = {}
+        order_append = dst._order.append
+        for node in src._order_map:
+            el = node.content
+            if el.kind == ElementKind.BLOCK:
+                child = BlockPar(el.content.sorted, backend=el.content.backend)
+                stack.append((el.content, child))
+                el = copies[id(node.content)] = BlockParElement(el.name, child)
+            order_append(el)
+        # elements come out of the search map sorted, a linear bulk build
+        dst._search.extend([copies.get(id(node.content), node.content)
+                            for node in src._search_map])
+    return result
+
+
+class IncludeResolver:
+    """
+    Loader of the files included by `name=path {` lines of text
+    BlockPars. Relative paths are looked up next to the including file
+    first, then in the current directory.
+
+    Included files are read ahead on a thread pool as soon as the text
+    including them is loaded. The pool is started by the first file read
+    ahead. Parsing holds the GIL and stays on the
+    loading thread. Every parsed file is kept by absolute path until it
+    or a file it includes is modified, so a file included many times is
+    parsed once.
+
+    workers: threads reading files ahead, None takes the default of
+    ThreadPoolExecutor, 1 reads every file when it is needed
+    share: hand out the cached block itself instead of a copy, cheaper,
+    but a change of one include shows up in all of them. Include lines
+    with a sort marker of their own or elements in their braces still
+    get a copy.
+    """
+
+    def __init__(self, workers: Optional[int] = None, *,
+                 share: bool = False, encoding: str = 'cp1251'):
+        self.workers = workers
+        self.share = share
+        self.encoding = encoding
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._executor = None  # type: Optional[ThreadPoolExecutor]
+        # absolute path -> future of (mtime, text)
+        self._pending = {}
+        # absolute path -> ({path: mtime} of the file and its includes,
+        # block)
+        self._parsed = {}
+        # files being parsed by the current thread
+        self._local = threading.local()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self):
+        """Stop the thread pool, it is started again by the next load"""
+        with self._lock:
+            executor = self._executor
+            self._executor = None
+            self._pending.clear()
+        if executor is not None:
+            executor.shutdown()
+
+    def clear(self):
+        """Drop the parsed files"""
+        with self._lock:
+            self._parsed.clear()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def resolve(include: str, including: Optional[str] = None) -> str:
+        """Absolute path of the file included by the file including"""
+        if including is not None and not os.path.isabs(include):
+            path = os.path.join(os.path.dirname(including), include)
+            if os.path.exists(path):
+                return os.path.abspath(path)
+        return os.path.abspath(include)
+
+    def _read(self, path: str) -> Tuple[int, str]:
+        mtime = os.stat(path).st_mtime_ns
+        with open(path, 'rt', encoding=self.encoding, newline='') as txt:
+            return mtime, txt.read()
+
+    def prefetch(self, includes: Iterable[str],
+                 including: Optional[str] = None):
+        """Start reading the included files on the thread pool"""
+        if self.workers is not None and self.workers <= 1:
+            return
+        with self._lock:
+            for include in includes:
+                path = self.resolve(include, including)
+                if path in self._pending or path in self._parsed:
+                    continue
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(self.workers)
+                self._pending[path] = self._executor.submit(self._read, path)
+
+    @staticmethod
+    def _is_current(files: Dict[str, int]) -> bool:
+        try:
+            return all(os.stat(path).st_mtime_ns == mtime
+                       for path, mtime in files.items())
+        except OSError:
+            return False
+
+    def load(self, include: str, including: Optional[str] = None
+             ) -> BlockPar:
+        """Block of the file included by the file including"""
+        path = self.resolve(include, including)
+        # (path, files it depends on) of the files being parsed
+        # by the current thread
+        loading = self._local.__dict__.setdefault('loading', [])
+        if any(path == loading_path for loading_path, files in loading):
+            raise Exception(f"IncludeResolver.load: include cycle at {path}")
+
+        with self._lock:
+            cached = self._parsed.get(path)
+            future = self._pending.pop(path, None)
+
+        if cached is not None and self._is_current(cached[0]):
+            self.hits += 1
+            files, block = cached
+        else:
+            self.misses += 1
+            mtime = os.stat(path).st_mtime_ns
+            text = None
+            if future is not None:
+                read_mtime, text = future.result()
+                if read_mtime != mtime:
+                    text = None
+            if text is None:
+                mtime, text = self._read(path)
+
+            # the block is current while neither the file
+            # nor any file included by it changes
+            files = {path: mtime}
+            block = BlockPar()
+            loading.append((path, files))
+            try:
+                block.load_txt_str(text, path=path, resolver=self)
+            finally:
+                loading.pop()
+            with self._lock:
+                self._parsed[path] = (files, block)
+
+        if loading:
+            loading[-1][1].update(files)
+
+        if self.share:
+            return block
+        return _copy_blockpar(block)
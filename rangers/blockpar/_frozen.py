@@ -0,0 +1,221 @@
+__all__ = [
+    "FrozenBlockPar",
+]
+
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import deque
+from typing import List, Union
+
+from ._blockpar import BlockPar, ElementKind
+
+
+class _Tables:
+    """
+    Column storage shared by all blocks of a frozen tree.
+
+    Elements of a block are stored contiguously in insertion order,
+    block b owns elements start[b] .. start[b] + count[b] - 1.
+    Names are numbered in sorted order, so a block's slice of
+    sorted_names is ordered and can be bisected by name id.
+    """
+
+    def __init__(self):
+        # string tables
+        self.names = []  # type: List[str]
+        self.name_ids = {}  # name -> index in names
+        self.values = []  # type: List[str]
+
+        # per element
+        self.name = array('I')
+        self.value = array('I')  # value id for params, block id for blocks
+        self.kind = bytearray()
+        self.perm = array('I')  # elements of every block in sorted order
+        self.sorted_names = array('I')  # name ids in the order of perm
+
+        # per block
+        self.start = array('I')
+        self.count = array('I')
+        self.parent = array('i')
+        self.sorted = bytearray()
+
+
+class FrozenBlockPar:
+    """
+    Read-only BlockPar stored as parallel arrays over interned string
+    tables. Takes a fraction of the memory of a BlockPar and answers
+    lookups with a hash probe and a bisect over an array.
+
+    Created with FrozenBlockPar.from_blockpar, turned back into
+    a mutable BlockPar with thaw.
+    """
+
+    def __init__(self, tables: _Tables, block: int = 0):
+        self._t = tables
+        self._block = block
+
+    @classmethod
+    def from_blockpar(cls, bp: BlockPar) -> 'FrozenBlockPar':
+        t = _Tables()
+
+        # breadth-first walk, so the elements of every block are contiguous
+        elements = []
+        values = {}
+        blocks = 1
+        queue = deque([(bp, -1)])
+        while queue:
+            block, parent = queue.popleft()
+            block_id = len(t.start)
+            t.start.append(len(elements))
+            t.count.append(len(block))
+            t.parent.append(parent)
+            t.sorted.append(block.sorted)
+            for node in block._order_map:
+                el = node.content
+                if el.kind == ElementKind.BLOCK:
+                    queue.append((el.content, block_id))
+                    value = blocks
+                    blocks += 1
+                else:
+                    value = values.setdefault(el.content, len(values))
+                elements.append((el.name, value, int(el.kind)))
+
+        t.names = sorted(set(name for name, value, kind in elements))
+        t.name_ids = {name: i for i, name in enumerate(t.names)}
+        t.values = list(values)
+
+        name_ids = t.name_ids
+        t.name = array('I', [name_ids[name] for name, value, kind
+                             in elements])
+        t.value = array('I', [value for name, value, kind in elements])
+        t.kind = bytearray(kind for name, value, kind in elements)
+        del elements
+
+        key = t.name.__getitem__
+        for start, count in zip(t.start, t.count):
+            # stable, equal names keep their insertion order
+            t.perm.extend(sorted(range(start, start + count), key=key))
+        t.sorted_names = array('I', [t.name[i] for i in t.perm])
+
+        return cls(t)
+
+    def thaw(self) -> BlockPar:
+        t = self._t
+        result = BlockPar(self.sorted)
+        stack = [(result, self._block)]
+        while stack:
+            bp, block = stack.pop()
+            items = []
+            for i in range(t.start[block], t.start[block] + t.count[block]):
+                if t.kind[i] == ElementKind.BLOCK:
+                    child = BlockPar(t.sorted[t.value[i]] == 1)
+                    stack.append((child, t.value[i]))
+                    items.append((t.names[t.name[i]], child))
+                else:
+                    items.append((t.names[t.name[i]], t.values[t.value[i]]))
+            bp.extend(items)
+        return result
+
+    @property
+    def sorted(self) -> bool:
+        return self._t.sorted[self._block] == 1
+
+    @property
+    def parent(self) -> Union['FrozenBlockPar', None]:
+        parent = self._t.parent[self._block]
+        if parent < 0:
+            return None
+        return FrozenBlockPar(self._t, parent)
+
+    def _content(self, i: int) -> Union[str, 'FrozenBlockPar']:
+        t = self._t
+        if t.kind[i] == ElementKind.BLOCK:
+            return FrozenBlockPar(t, t.value[i])
+        return t.values[t.value[i]]
+
+    def _find(self, key: str):
+        """Range of perm holding the elements named key"""
+        t = self._t
+        name = t.name_ids.get(key)
+        if name is None:
+            return 0, 0
+        lo = t.start[self._block]
+        hi = lo + t.count[self._block]
+        lo = bisect_left(t.sorted_names, name, lo, hi)
+        return lo, bisect_right(t.sorted_names, name, lo, hi)
+
+    def __eq__(self, other):
+        return (isinstance(other, FrozenBlockPar) and self._t is other._t
+                and self._block == other._block)
+
+    def __hash__(self):
+        return hash((id(self._t), self._block))
+
+    def __contains__(self, key: str) -> bool:
+        lo, hi = self._find(key)
+        return lo < hi
+
+    def __len__(self):
+        return self._t.count[self._block]
+
+    def __iter__(self) -> Union[str, 'FrozenBlockPar']:
+        t = self._t
+        start = t.start[self._block]
+        end = start + t.count[self._block]
+        if self.sorted:
+            src = t.perm[start:end]
+        else:
+            src = range(start, end)
+        for i in src:
+            yield self._content(i)
+
+    def get(self, key: str) -> Union[str, 'FrozenBlockPar']:
+        return self.getone(key)
+
+    def getone(self, key: str) -> Union[str, 'FrozenBlockPar']:
+        lo, hi = self._find(key)
+        if lo == hi:
+            raise KeyError
+        return self._content(self._t.perm[lo])
+
+    def getall(self, key: str) -> List[Union[str, 'FrozenBlockPar']]:
+        lo, hi = self._find(key)
+        if lo == hi:
+            raise KeyError
+        perm = self._t.perm
+        return [self._content(perm[i]) for i in range(lo, hi)]
+
+    def _get_path(self, path: str) -> int:
+        """Element at path, only the last part may name a parameter"""
+        t = self._t
+        name_ids = t.name_ids
+        sorted_names = t.sorted_names
+        parts = path.strip().split('.')
+        last = len(parts) - 1
+        block = self._block
+        for n, part in enumerate(parts):
+            name = name_ids.get(part)
+            lo = t.start[block]
+            hi = lo + t.count[block]
+            if name is not None:
+                lo = bisect_left(sorted_names, name, lo, hi)
+            if name is None or lo == hi or sorted_names[lo] != name:
+                raise Exception("FrozenBlockPar.get_par: path not exists")
+            i = t.perm[lo]
+            if n == last:
+                return i
+            if t.kind[i] != ElementKind.BLOCK:
+                raise Exception("FrozenBlockPar.get_par: path not exists")
+            block = t.value[i]
+
+    def get_par(self, path: str) -> str:
+        i = self._get_path(path)
+        if self._t.kind[i] != ElementKind.PARAM:
+            raise Exception("FrozenBlockPar.get_par: not a parameter")
+        return self._t.values[self._t.value[i]]
+
+    def get_block(self, path: str) -> 'FrozenBlockPar':
+        i = self._get_path(path)
+        if self._t.kind[i] != ElementKind.BLOCK:
+            raise Exception("FrozenBlockPar.get_par: not a block")
+        return FrozenBlockPar(self._t, self._t.value[i])
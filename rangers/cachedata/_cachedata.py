@@ -1,16 +1,29 @@
 __all__ = [
     "CacheData",
+    "Event",
 ]
 
 from enum import IntEnum
-from typing import Union, TextIO
+from io import BytesIO
+from itertools import islice
+from struct import Struct
+from typing import (Union, Iterable, Iterator, List, Optional, TextIO,
+                    Tuple)
 import warnings
 
 from rangers._blockpar_helper import *
-from rangers.io import AbstractIO, Buffer
+from rangers.io import (AbstractIO, Buffer, MappedBuffer, ChunkStream,
+                        iter_dat, write_dat, DAT_CHUNK_SIZE)
+from rangers.io._io import _find_widestr_end
 from rangers.common import bytes_xor, bytes_to_int
 
 
+_uint = Struct('<I')
+
+# default of get_many, missing paths come back as exceptions
+_missing = object()
+
+
 class ElementKind(IntEnum):
     UNDEF = 0
     PARAM = 1
@@ -38,9 +51,16 @@ class CacheDataElement:
 
 
 class CacheData:
+    # container backend of new blocks, one of BACKENDS:
+    # 'tree' keeps elements in a red-black tree, 'hash' in a dict
+    backend = 'tree'
 
-    def __init__(self):
-        self._search_map = RedBlackTree()
+    def __init__(self, *, backend: Optional[str] = None):
+        if backend is not None:
+            self.backend = backend
+        if self.backend not in BACKENDS:
+            raise ValueError(f"CacheData: unknown backend {self.backend}")
+        self._search_map = BACKENDS[self.backend][1]()
 
     def __setitem__(self, key: str, value: Union[str, 'CacheData']):
         warnings.warn("Mapping interface is deprecated, "
@@ -76,6 +96,14 @@ class CacheData:
         elem = CacheDataElement(key, value)
         self._search_map.append(elem)
 
+    def extend(self, items: Iterable[Tuple[str, Union[str, 'CacheData']]]):
+        """
+        Add (key, value) pairs in order. Pairs sorted by key are put into
+        an empty block in linear time.
+        """
+        self._search_map.extend(CacheDataElement(key, value)
+                                for key, value in items)
+
     def set(self, key: str, value: Union[str, 'CacheData']):
         self._search_map.remove_all(key)
         elem = CacheDataElement(key, value)
@@ -135,6 +163,7 @@ class CacheData:
         self.clear()
 
         curblock = self
+        items = []
 
         left = s.get_uint()
 
@@ -147,26 +176,134 @@ class CacheData:
                 name = s.get_widestr()
 
                 if type == ElementKind.PARAM:
-                    curblock.add(name, s.get_widestr())
+                    items.append((name, s.get_widestr()))
                     left -= 1
 
                 elif type == ElementKind.BLOCK:
-                    stack.append((curblock, left))
+                    stack.append((curblock, left, items))
 
-                    prevblock = curblock
-                    curblock = CacheData()
-                    prevblock.add(name, curblock)
+                    curblock = CacheData(backend=self.backend)
+                    items.append((name, curblock))
+                    items = []
 
                     left = s.get_uint()
                     level += 1
                     continue
 
             else:
+                # elements come in key order,
+                # so extend builds the search tree in linear time
+                curblock.extend(items)
                 if level > 0:
-                    curblock, left = stack.pop()
+                    curblock, left, items = stack.pop()
                     left -= 1
                 level -= 1
 
+    def load_bytes(self, data: Union[bytes, bytearray, memoryview]):
+        """
+        Fast variant of load: walks the serialized data with a local cursor
+        instead of reading it through AbstractIO and builds the blocks
+        directly. load is kept as the reference implementation.
+        """
+        self.clear()
+
+        if not isinstance(data, (bytes, bytearray)):
+            data = bytes(data)
+        unpack_uint = _uint.unpack_from
+
+        cache = AbstractIO.widestr_cache
+
+        def get_widestr(pos):
+            end = _find_widestr_end(data, pos, pos)
+            if end < 0:
+                raise ValueError("CacheData.load_bytes: "
+                                 "unexpected end of data")
+            if cache is not None:
+                return cache.decode(bytes(data[pos:end])), end + 2
+            return data[pos:end].decode('utf-16le'), end + 2
+
+        curblock = self
+        left, = unpack_uint(data, 0)
+        pos = 4
+        items = []
+
+        stack = list()
+
+        while True:
+            if left > 0:
+                kind = data[pos]
+                name, pos = get_widestr(pos + 1)
+
+                if kind == 1:  # ElementKind.PARAM
+                    value, pos = get_widestr(pos)
+                    items.append((name, value))
+                    left -= 1
+
+                elif kind == 2:  # ElementKind.BLOCK
+                    stack.append((curblock, left, items))
+
+                    curblock = CacheData(backend=self.backend)
+                    items.append((name, curblock))
+                    items = []
+
+                    left, = unpack_uint(data, pos)
+                    pos += 4
+
+                else:
+                    raise ValueError("CacheData.load_bytes: unknown element")
+
+            else:
+                curblock.extend(items)
+                if not stack:
+                    break
+                curblock, left, items = stack.pop()
+                left -= 1
+
+    @staticmethod
+    def iter_events(source: Union[AbstractIO, bytes, bytearray, memoryview]
+                    ) -> Iterator[Tuple[Event, str, Optional[str]]]:
+        """
+        Walk the data read by load without building blocks, yields
+        (Event.BLOCK_START, name, None), (Event.PARAM, name, value) and
+        (Event.BLOCK_END, name, None) in file order. The root block has
+        no events of its own. An AbstractIO source is read as the events
+        are taken, so a ChunkStream keeps memory bounded by its chunks.
+        """
+        if isinstance(source, AbstractIO):
+            s = source
+        else:
+            s = Buffer(BytesIO(source))
+
+        left = s.get_uint()
+        name = None
+
+        stack = list()
+
+        while True:
+            if left > 0:
+                kind = s.get_byte()
+                el_name = s.get_widestr()
+
+                if kind == ElementKind.PARAM:
+                    yield Event.PARAM, el_name, s.get_widestr()
+                    left -= 1
+
+                elif kind == ElementKind.BLOCK:
+                    stack.append((name, left))
+                    name = el_name
+                    left = s.get_uint()
+                    yield Event.BLOCK_START, name, None
+
+                else:
+                    raise ValueError("CacheData.iter_events: unknown element")
+
+            else:
+                if not stack:
+                    break
+                yield Event.BLOCK_END, name, None
+                name, left = stack.pop()
+                left -= 1
+
     def load_txt(self, f: TextIO):
         self.clear()
 
@@ -208,7 +345,7 @@ class CacheData:
                     curblock[name] = CacheData.from_txt(path)
                 else:
                     prevblock = curblock
-                    curblock = CacheData()
+                    curblock = CacheData(backend=self.backend)
                     prevblock.add(name, curblock)
 
                     level += 1
@@ -229,58 +366,77 @@ class CacheData:
                 continue
 
     def save_txt(self, f: TextIO):
+        for chunk in self.iter_txt():
+            f.write(chunk)
+
+    def iter_txt(self, chunk_size: int = 1 << 16) -> Iterator[str]:
+        """
+        Text written by save_txt, rendered line by line and given out
+        in pieces of at least chunk_size characters, the last one shorter
+        """
+        parts = []
+        append = parts.append
+        size = 0
+        PARAM = ElementKind.PARAM
+        BLOCK = ElementKind.BLOCK
+
         curblock = self._search_map.__iter__()
         left = len(self)
 
         level = 0
+        indent = ''  # 4 spaces level padding
         stack = list()
 
-        while level > -1:
+        while True:
             if left > 0:
                 node = next(curblock)
                 el = node.content
-                f.write(4 * '\x20' * level)
 
-                if el.kind == ElementKind.PARAM:
-                    f.write(el.name)
-                    f.write('=')
-                    f.write(el.content)
-                    f.write('\x0d\x0a')
+                if el.kind == PARAM:
+                    line = f'{indent}{el.name}={el.content}\x0d\x0a'
                     left -= 1
 
-                elif el.kind == ElementKind.BLOCK:
+                elif el.kind == BLOCK:
                     stack.append((curblock, left))
 
                     curblock = el.content._search_map.__iter__()
                     left = len(el.content)
 
-                    f.write(el.name)
-                    f.write('\x20')  # space
-                    f.write('{')
-                    f.write('\x0d\x0a')  # \r\n
+                    line = f'{indent}{el.name} {{\x0d\x0a'
                     level += 1
-                    continue
+                    indent = 4 * '\x20' * level
 
                 else:
-                    f.write('\x0d\x0a')
+                    line = f'{indent}\x0d\x0a'
+                    left -= 1
             else:
                 level -= 1
-                if level > -1:
-                    f.write(4 * '\x20' * level)  # 4 spaces level padding
-                    f.write('}')
-                    f.write('\x0d\x0a')  # \r\n
-                    curblock, left = stack.pop()
-                    left -= 1
+                if level < 0:
+                    break
+                indent = 4 * '\x20' * level
+                line = f'{indent}}}\x0d\x0a'
+                curblock, left = stack.pop()
+                left -= 1
+
+            append(line)
+            size += len(line)
+            if size >= chunk_size:
+                yield ''.join(parts)
+                parts.clear()
+                size = 0
+
+        if parts:
+            yield ''.join(parts)
 
     def get_par(self, path: str) -> str:
         path = path.strip().split('.')
 
         curblock = self
-        for part in path:
+        for i, part in enumerate(path):
             el = curblock._search_map.find(part)
             if el is None:
                 raise Exception("CacheData.get_par: path not exists")
-            if part != path[-1]:
+            if i != len(path) - 1:
                 if el.content.kind is not ElementKind.BLOCK:
                     raise Exception("CacheData.get_par: path not exists")
                 curblock = el.content.content
@@ -293,11 +449,11 @@ class CacheData:
         path = path.strip().split('.')
 
         curblock = self
-        for part in path:
+        for i, part in enumerate(path):
             el = curblock._search_map.find(part)
             if el is None:
                 raise Exception("CacheData.get_par: path not exists")
-            if part != path[-1]:
+            if i != len(path) - 1:
                 if el.content.kind is not ElementKind.BLOCK:
                     raise Exception("CacheData.get_par: path not exists")
                 curblock = el.content.content
@@ -306,6 +462,95 @@ class CacheData:
                     raise Exception("CacheData.get_par: not a block")
                 return el.content.content
 
+    def get_at(self, index: int) -> Tuple[str, Union[str, 'CacheData']]:
+        """
+        Name and value of the element at position index in key order,
+        negative indexes count from the end
+        """
+        if index < 0:
+            index += len(self)
+        el = self._search_map.select(index).content
+        return el.name, el.content
+
+    def slice(self, start: Optional[int] = None, stop: Optional[int] = None
+              ) -> List[Tuple[str, Union[str, 'CacheData']]]:
+        """(name, value) of the elements start:stop in key order"""
+        start, stop, step = slice(start, stop).indices(len(self))
+        return [(node.content.name, node.content.content)
+                for node in islice(self._search_map.iter_at(start),
+                                   max(stop - start, 0))]
+
+    def iter_range(self, lo: str, hi: Optional[str] = None
+                   ) -> Iterator[Tuple[str, Union[str, 'CacheData']]]:
+        """(name, value) of the elements with lo <= name < hi in key order"""
+        for node in self._search_map.iter_range(lo, hi):
+            yield node.content.name, node.content.content
+
+    def iter_prefix(self, prefix: str
+                    ) -> Iterator[Tuple[str, Union[str, 'CacheData']]]:
+        """(name, value) of the elements with names starting with prefix"""
+        for node in self._search_map.iter_prefix(prefix):
+            yield node.content.name, node.content.content
+
+    def get_many(self, paths: Iterable[str],
+                 default=_missing) -> List[Union[str, 'CacheData', Exception]]:
+        """
+        Resolve many dotted paths at once, values come back in the order
+        of paths. Parent paths are resolved once and remembered, each one
+        from its own parent, so blocks shared by several paths are
+        searched only once.
+        Missing paths get default if given, an Exception instance otherwise.
+        """
+        # resolved parent paths, the root is None, missing blocks are None
+        blocks = {None: self}
+
+        def resolve(path):
+            parent, sep, name = path.rpartition('.')
+            parent = parent if sep else None
+            block = blocks.get(parent, _missing)
+            if block is _missing:
+                block = resolve(parent)
+            if block is not None:
+                node = block._search_map.find(name)
+                if node is not None and node.content.kind is ElementKind.BLOCK:
+                    block = node.content.content
+                else:
+                    block = None
+            blocks[path] = block
+            return block
+
+        result = []
+        append = result.append
+        for path in paths:
+            parent, sep, name = path.strip().rpartition('.')
+            parent = parent if sep else None
+            block = blocks.get(parent, _missing)
+            if block is _missing:
+                block = resolve(parent)
+            node = block._search_map.find(name) if block is not None else None
+            if node is not None:
+                append(node.content.content)
+            elif default is _missing:
+                append(Exception("CacheData.get_many: path not exists"))
+            else:
+                append(default)
+        return result
+
+    def query(self, pattern: str
+              ) -> Iterator[Tuple[str, Union[str, 'CacheData']]]:
+        """
+        Lazily yield (path, value) of every element matching a dotted
+        pattern, e.g. 'Ships.*.Weapons.*.Damage', 'Lang.Item*.Name' or
+        '**.Name'. Segments are names, globs ('*', 'Item*', '[ab]?') or
+        '**' for any number of levels. Names and prefixes are found with
+        range scans of the search tree, '*' lists elements in key order.
+        """
+        def elements(block):
+            for node in block._search_map:
+                yield node.content
+
+        return iter_query(self, pattern, elements)
+
     def to_txt(self, path: str, encoding: str = 'cp1251'):
         with open(path, 'wt', encoding=encoding, newline='') as txt:
             self.save_txt(txt)
@@ -318,11 +563,23 @@ class CacheData:
         return cachedata
 
     @classmethod
-    def from_dat(cls, path: str) -> 'CacheData':
+    def from_dat(cls, path: str, *, streaming: bool = False,
+                 chunk_size: int = DAT_CHUNK_SIZE) -> 'CacheData':
+        """
+        streaming: decipher, hash and inflate the file chunk by chunk while
+        parsing, peak memory then depends on chunk_size, not on the file size
+        """
         cachedata = None
         seed_key = b'\x37\x3f\x8f\xea'
 
-        b = Buffer.from_file(path)
+        if streaming:
+            with ChunkStream(iter_dat(path, seed_key, chunk_size)) as s:
+                cachedata = cls()
+                cachedata.load(s)
+                s.drain()
+            return cachedata
+
+        b = MappedBuffer.from_file(path, copy_on_write=True)
 
         content_hash = b.get_uint()
 
@@ -335,14 +592,40 @@ class CacheData:
         calc_hash = b.calc_hash(size)
 
         if calc_hash == content_hash:
-            unpacked = Buffer.from_bytes(b.decompress(size))
+            unpacked = b.decompress(size)
             b.close()
             cachedata = cls()
-            cachedata.load(unpacked)
-            unpacked.close()
+            cachedata.load_bytes(unpacked)
         else:
             b.close()
             raise Exception("CacheData.from_dat: wrong content hash")
 
         return cachedata
 
+    @staticmethod
+    def iter_dat_events(path: str, *, chunk_size: int = DAT_CHUNK_SIZE
+                        ) -> Iterator[Tuple[Event, str, Optional[str]]]:
+        """
+        iter_events over a .dat file deciphered and inflated chunk by
+        chunk, the content hash is verified after the last event
+        """
+        seed_key = b'\x37\x3f\x8f\xea'
+
+        with ChunkStream(iter_dat(path, seed_key, chunk_size)) as s:
+            yield from CacheData.iter_events(s)
+            s.drain()
+
+    def to_dat(self, path: str, seed: Optional[int] = None, *,
+               level: int = 6, workers: Optional[int] = None):
+        """
+        Inverse of from_dat: serializes, compresses (ZL03), hashes and
+        enciphers the data, streaming every chunk into the file.
+        seed: cipher seed, random by default
+        """
+        seed_key = b'\x37\x3f\x8f\xea'
+
+        b = Buffer(BytesIO())
+        self.save(b)
+        b.seek(0)
+        write_dat(path, b, seed_key, seed, level=level, workers=workers)
+        b.close()
@@ -1 +1,2 @@
 from ._io import *
+from ._dat import *
@@ -0,0 +1,151 @@
+__all__ = [
+    "inflate_chunks",
+    "iter_dat",
+    "write_dat",
+    "DAT_CHUNK_SIZE",
+]
+
+import random
+import zlib
+from struct import pack, unpack
+from typing import Iterable, Iterator, Optional
+
+from rangers.common import bytes_xor, bytes_to_int, int_to_bytes
+from ._keystream import xor_keystream
+from ._io import AbstractIO, ZL03_CHUNK_SIZE, _iter_deflate_zl03
+
+DAT_CHUNK_SIZE = 1 << 16
+
+
+def inflate_chunks(chunks: Iterable[bytes],
+                   max_length: int = DAT_CHUNK_SIZE) -> Iterator[bytes]:
+    """
+    Incremental counterpart of AbstractIO.decompress: takes a ZL01/ZL03
+    payload as an iterable of chunks and yields the inflated data in
+    pieces of at most max_length bytes
+    """
+    chunks = iter(chunks)
+    pending = bytearray()
+
+    def take(size: int) -> bytes:
+        while len(pending) < size:
+            chunk = next(chunks, None)
+            if chunk is None:
+                raise ValueError("inflate_chunks: unexpected end of data")
+            pending.extend(chunk)
+        result = bytes(pending[:size])
+        del pending[:size]
+        return result
+
+    def inflate(size: int):
+        # size == -1 inflates up to the end of the data
+        d = zlib.decompressobj()
+        while size != 0:
+            if not pending:
+                chunk = next(chunks, None)
+                if chunk is None:
+                    if size < 0:
+                        break
+                    raise ValueError("inflate_chunks: unexpected end of data")
+                pending.extend(chunk)
+            n = len(pending) if size < 0 else min(size, len(pending))
+            data = bytes(pending[:n])
+            del pending[:n]
+            if size > 0:
+                size -= n
+            while data:
+                result = d.decompress(data, max_length)
+                if result:
+                    yield result
+                data = d.unconsumed_tail
+        result = d.flush()
+        if result:
+            yield result
+
+    magic = take(4)
+    if magic == b'ZL01':
+        take(4)  # inflated size
+        yield from inflate(-1)
+    elif magic == b'ZL03':
+        for i in range(unpack('<i', take(4))[0]):
+            yield from inflate(unpack('<I', take(4))[0])
+    else:
+        raise ValueError("inflate_chunks: unknown format")
+
+
+def iter_dat(path: str, seed_key: bytes,
+             chunk_size: int = DAT_CHUNK_SIZE) -> Iterator[bytes]:
+    """
+    Streaming .dat reader: deciphers the file chunk by chunk, computes the
+    content hash incrementally and yields the inflated payload.
+    The content hash is verified once the payload is exhausted.
+    """
+    with open(path, 'rb') as f:
+        content_hash = unpack('<I', f.read(4))[0]
+        seed = bytes_to_int(bytes_xor(f.read(4), seed_key))
+        crc = 0
+
+        def deciphered():
+            nonlocal crc
+            offset = 0
+            while True:
+                chunk = bytearray(f.read(chunk_size))
+                if not chunk:
+                    return
+                xor_keystream(memoryview(chunk), seed, offset)
+                crc = zlib.crc32(chunk, crc)
+                offset += len(chunk)
+                yield chunk
+
+        source = deciphered()
+        try:
+            yield from inflate_chunks(source, chunk_size)
+        except (ValueError, zlib.error):
+            for chunk in source:
+                pass
+            if crc != content_hash:
+                raise Exception("iter_dat: wrong content hash")
+            raise
+        for chunk in source:
+            pass
+        if crc != content_hash:
+            raise Exception("iter_dat: wrong content hash")
+
+
+def write_dat(path: str, s: AbstractIO, seed_key: bytes,
+              seed: Optional[int] = None, size: int = -1, *,
+              level: int = 9, chunk_size: int = ZL03_CHUNK_SIZE,
+              workers: Optional[int] = None):
+    """
+    Streaming .dat writer, inverse of iter_dat: compresses the next size
+    bytes of s into a ZL03 payload chunk by chunk, hashes and enciphers
+    every chunk as it is produced and writes it out. The content hash is
+    written into the header at the end. A random seed is used by default.
+    """
+    if seed is None:
+        seed = random.randint(1, 0x7ffffffe)
+    if size == -1:
+        size = s.size() - s.pos()
+    if workers is None:
+        workers = s.compress_workers
+
+    with open(path, 'wb') as f:
+        f.write(bytes(8))  # content hash and seed, written at the end
+        crc = 0
+        offset = 0
+
+        def put(chunk: bytes):
+            nonlocal crc, offset
+            chunk = bytearray(chunk)
+            crc = zlib.crc32(chunk, crc)
+            xor_keystream(memoryview(chunk), seed, offset)
+            offset += len(chunk)
+            f.write(chunk)
+
+        put(b'ZL03' + pack('<i', -(-size // chunk_size)))
+        for chunk in _iter_deflate_zl03(s, size, chunk_size, level, workers):
+            put(pack('<I', len(chunk)) + chunk)
+
+        f.seek(0)
+        f.write(pack('<I', crc))
+        f.write(bytes_xor(int_to_bytes(seed), seed_key))
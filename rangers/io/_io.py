@@ -2,18 +2,173 @@ __all__ = [
     "AbstractIO",
     "Stream",
     "Buffer",
+    "MappedBuffer",
+    "ChunkStream",
+    "KeystreamCache",
+    "WidestrCache",
     "SEEK_END", "SEEK_SET", "SEEK_CUR",
 ]
 
+import mmap
+import os
+import sys
 import zlib
-from io import BytesIO, SEEK_CUR, SEEK_SET, SEEK_END
-from struct import pack, unpack
+from array import array
+from io import BytesIO, UnsupportedOperation, SEEK_CUR, SEEK_SET, SEEK_END
+from struct import Struct, pack, unpack
 from abc import abstractmethod
-from collections import namedtuple
-from typing import Union, BinaryIO, NamedTuple
+from collections import deque, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from typing import (Union, BinaryIO, Iterable, Iterator,
+                    NamedTuple, Optional)
+
+from ._keystream import jump, xor_bytes, xor_keystream, KeystreamCache
+
+try:
+    import numpy as np
+except ImportError:  # numpy is optional
+    np = None
+
+# array.array typecodes and numpy dtypes of the primitive types
+_array_types = {
+    'byte': ('B', '<u1'),
+    'word': ('H', '<u2'),
+    'int': ('i', '<i4'),
+    'uint': ('I', '<u4'),
+    'single': ('f', '<f4'),
+    'double': ('d', '<f8'),
+}
+
+
+def _find_widestr_end(buf, pos: int, start: int) -> int:
+    """
+    Position of the null terminator of the UTF-16 string starting at pos,
+    searching from start (aligned to pos), or -1
+    """
+    end = buf.find(b'\x00\x00', start)
+    while end != -1 and (end - pos) & 1:
+        end = buf.find(b'\x00\x00', end + 1)
+    return end
+
+
+class WidestrCache:
+    """
+    Decode cache of UTF-16 strings keyed by their raw bytes. Decoded
+    strings are interned, so repeated names share one object and
+    compare by identity.
+    budget: memory budget for the raw keys in bytes, once it is spent
+    new strings are decoded but not cached
+    max_length: longer strings (in bytes) are never cached
+    """
+
+    def __init__(self, budget: int = 1 << 20, max_length: int = 256):
+        self.budget = budget
+        self.max_length = max_length
+        self.hits = 0
+        self.misses = 0
+        self.saved = 0
+        self._size = 0
+        self._entries = {}
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, raw: bytes) -> bool:
+        return raw in self._entries
+
+    @property
+    def size(self) -> int:
+        """Memory used by the cached raw strings in bytes"""
+        return self._size
+
+    def clear(self):
+        self._entries.clear()
+        self._size = 0
+        self.hits = 0
+        self.misses = 0
+        self.saved = 0
+
+    def decode(self, raw: bytes) -> str:
+        entry = self._entries.get(raw)
+        if entry is not None:
+            self.hits += 1
+            # a hit saves the allocation of an equal string
+            self.saved += entry[1]
+            return entry[0]
+        self.misses += 1
+        result = raw.decode('utf-16le')
+        size = len(raw)
+        if size <= self.max_length and self._size + size <= self.budget:
+            result = sys.intern(result)
+            self._entries[raw] = (result, sys.getsizeof(result))
+            self._size += size
+        return result
+
+
+# size of the uncompressed ZL03 chunks
+ZL03_CHUNK_SIZE = 65000
+
+
+def _inflate_zl03(chunks: list, workers: int) -> bytes:
+    def inflate(chunk):
+        return zlib.decompress(chunk, bufsize=ZL03_CHUNK_SIZE)
+
+    try:
+        if workers > 1 and len(chunks) > 1:
+            # zlib releases the GIL while inflating
+            with ThreadPoolExecutor(min(workers, len(chunks))) as executor:
+                parts = list(executor.map(inflate, chunks))
+        else:
+            parts = [inflate(chunk) for chunk in chunks]
+    finally:
+        for chunk in chunks:
+            if isinstance(chunk, memoryview):
+                chunk.release()
+
+    return b''.join(parts)
+
+
+def _iter_deflate_zl03(s: 'AbstractIO', size: int, chunk_size: int,
+                       level: int, workers: int) -> Iterator[bytes]:
+    """
+    Compress the next size bytes of s in chunks of chunk_size bytes,
+    yield the compressed chunks in order keeping at most 2 * workers
+    chunks in flight
+    """
+    def deflate(chunk):
+        try:
+            return zlib.compress(chunk, level)
+        finally:
+            if isinstance(chunk, memoryview):
+                chunk.release()
+
+    count = -(-size // chunk_size)
+    if workers <= 1 or count <= 1:
+        for i in range(count):
+            yield deflate(s._get_chunk(min(chunk_size, size)))
+            size -= chunk_size
+        return
+
+    # zlib releases the GIL while deflating
+    with ThreadPoolExecutor(workers) as executor:
+        pending = deque()
+        for i in range(count):
+            chunk = s._get_chunk(min(chunk_size, size))
+            size -= chunk_size
+            pending.append(executor.submit(deflate, chunk))
+            if len(pending) >= 2 * workers:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
 
 
 class AbstractIO:
+    # default number of threads processing ZL03 chunks
+    decompress_workers = os.cpu_count() or 1
+    compress_workers = os.cpu_count() or 1
+    # strings read with get_widestr are decoded through this cache if set,
+    # binary loaders working on raw bytes use it as well
+    widestr_cache = None  # type: Optional[WidestrCache]
 
     def __init__(self, io=None):
         self._io = io
@@ -74,6 +229,23 @@ class AbstractIO:
         if v.__class__.__name__ in TypeStruct._structs_cache:
             TypeStruct._structs_cache[v.__class__.__name__]._add(self, v)
 
+    def add_array(self, kind: str, v):
+        """
+        Write a sequence of primitive values (array.array, numpy array
+        or any iterable) of kind 'byte', 'word', 'int', 'uint', 'single'
+        or 'double'
+        """
+        typecode, dtype = _array_types[kind]
+        if np is not None and isinstance(v, np.ndarray):
+            self._io.write(v.astype(dtype, copy=False).tobytes())
+            return
+        if not isinstance(v, array) or v.typecode != typecode:
+            v = array(typecode, v)
+        if sys.byteorder == 'big':
+            v = array(typecode, v)
+            v.byteswap()
+        self._io.write(v.tobytes())
+
     def get(self, size: int) -> bytes:
         return self._io.read(size)
 
@@ -99,31 +271,64 @@ class AbstractIO:
         return unpack('<d', self._io.read(8))[0]
 
     def get_widestr(self) -> str:
-        start = self._io.tell()
-        size = 0
+        # read ahead in growing windows and seek back past the terminator
+        buf = bytearray()
+        start = 0
+        window = 64
         while True:
-            c = self._io.read(2)
-            if c is None or len(c) < 2:
+            chunk = self._io.read(window)
+            if not chunk:
                 return ''
-            elif c == b'\x00\x00':
-                size = self._io.tell() - start - 2
-                break
-            else:
-                continue
-        self._io.seek(start)
-        s = self._io.read(size).decode('utf-16le')
-        self._io.seek(2, SEEK_CUR)
-        return s
+            buf += chunk
+            end = _find_widestr_end(buf, 0, start)
+            if end != -1:
+                self._io.seek(end + 2 - len(buf), SEEK_CUR)
+                return self._decode_widestr(buf[:end])
+            start = len(buf) & ~1
+            window *= 2
+
+    def _decode_widestr(self, raw: Union[bytes, bytearray]) -> str:
+        cache = self.widestr_cache
+        if cache is None:
+            return raw.decode('utf-16le')
+        return cache.decode(bytes(raw))
 
     def get_struct(self, t: 'TypeStruct') -> NamedTuple:
         return t._get(self)
 
+    def get_array(self, kind: str, n: int, *, numpy: bool = False):
+        """
+        Read n primitive values of kind 'byte', 'word', 'int', 'uint',
+        'single' or 'double' as an array.array, or as a numpy array
+        """
+        typecode, dtype = _array_types[kind]
+        data = self.get(n * array(typecode).itemsize)
+        if numpy:
+            if np is None:
+                raise ImportError("AbstractIO.get_array: "
+                                  "numpy is not installed")
+            return np.frombuffer(bytearray(data), dtype=dtype)
+        result = array(typecode)
+        result.frombytes(data)
+        if sys.byteorder == 'big':
+            result.byteswap()
+        return result
+
     @abstractmethod
     def _decompress(self, start: int, size: int, bufsize: int) -> bytes:
         """Abstract interface for zlib.decompress"""
         pass
 
-    def decompress(self, size: int = -1) -> bytes:
+    def _get_chunk(self, size: int):
+        """Compressed chunk data for decompress"""
+        return self.get(size)
+
+    def decompress(self, size: int = -1, *,
+                   workers: Optional[int] = None) -> bytes:
+        """
+        workers: number of threads inflating ZL03 chunks,
+        AbstractIO.decompress_workers by default, 1 inflates serially
+        """
         if size == -1:
             size = self.size() - self.pos()
 
@@ -138,37 +343,50 @@ class AbstractIO:
             self.close()
             raise ValueError("AbstractIO.decompress: unknown format")
         elif magic == b'ZL03':
+            chunks = []
             for i in range(self.get_int()):
                 chunksize = self.get_uint()
-                start = self.pos()
-                result += self._decompress(start, chunksize, 65000)
+                chunks.append(self._get_chunk(chunksize))
+            if workers is None:
+                workers = self.decompress_workers
+            result = _inflate_zl03(chunks, workers)
         else:
             self.close()
             raise ValueError("AbstractIO.decompress: unknown format")
         return result
 
-    def _compress(self):
-        pass
-
-    def compress(self, fmt: str, size: int = -1) -> bytes:
+    def compress(self, fmt: str, size: int = -1, *, level: int = 9,
+                 chunk_size: int = ZL03_CHUNK_SIZE,
+                 workers: Optional[int] = None) -> bytes:
         """
-        Supported formats: 'ZLO1', 'ZL02', 'ZL03'
+        Supported formats: 'ZL01', 'ZL03'
+        ZL03 chunks of chunk_size bytes are compressed independently on
+        workers threads, AbstractIO.compress_workers by default
         """
-        pass
-        # if size == -1:
-        #     size = self.size() - self.pos()
-
-        # result = b''
-        # if fmt == 'ZL01':
-        #     result += b'ZL01'
-        #     result += uint_to_bytes(sz)
-        #     result += zlib.compress(self.get(size),
-        #                             level=9)
-        # elif fmt == 'ZL02':
-        #     pass
-        # elif fmt == 'ZL03':
-        #     pass
-        # return result
+        if fmt not in ('ZL01', 'ZL03'):
+            self.close()
+            raise ValueError("AbstractIO.compress: unknown format")
+
+        if size == -1:
+            size = self.size() - self.pos()
+
+        if fmt == 'ZL01':
+            data = self._get_chunk(size)
+            try:
+                return b''.join((b'ZL01', pack('<I', len(data)),
+                                 zlib.compress(data, level)))
+            finally:
+                if isinstance(data, memoryview):
+                    data.release()
+
+        if workers is None:
+            workers = self.compress_workers
+        result = [b'ZL03', pack('<i', -(-size // chunk_size))]
+        for chunk in _iter_deflate_zl03(self, size, chunk_size,
+                                        level, workers):
+            result.append(pack('<I', len(chunk)))
+            result.append(chunk)
+        return b''.join(result)
 
 
 class Stream(AbstractIO):
@@ -202,7 +420,102 @@ class Stream(AbstractIO):
             return cls(io)
 
 
+class _ChunkReader:
+    """
+    Read-only file-like object over an iterable of byte chunks.
+    Keeps only the unread part of the current chunks and the last read,
+    so seeking back is possible within the last read only.
+    """
+
+    def __init__(self, chunks: Iterable[bytes]):
+        self._chunks = iter(chunks)
+        self._buf = bytearray()
+        self._off = 0
+        self._base = 0
+
+    def _more(self) -> bool:
+        chunk = next(self._chunks, None)
+        if chunk is None:
+            return False
+        if self._off > 0:
+            del self._buf[:self._off]
+            self._base += self._off
+            self._off = 0
+        self._buf += chunk
+        return True
+
+    def read(self, size: int = -1) -> bytes:
+        if size < 0:
+            while self._more():
+                pass
+            size = len(self._buf) - self._off
+        while len(self._buf) - self._off < size:
+            if not self._more():
+                break
+        result = bytes(self._buf[self._off:self._off + size])
+        self._off += len(result)
+        return result
+
+    def tell(self) -> int:
+        return self._base + self._off
+
+    def seek(self, n: int, flag: int = SEEK_SET) -> int:
+        if flag == SEEK_CUR:
+            n += self.tell()
+        elif flag != SEEK_SET:
+            raise UnsupportedOperation("seek from the end")
+        if not 0 <= n - self._base <= len(self._buf):
+            raise UnsupportedOperation("seek out of the buffered window")
+        self._off = n - self._base
+        return n
+
+    def close(self):
+        if hasattr(self._chunks, 'close'):
+            self._chunks.close()
+        self._buf = bytearray()
+
+
+class ChunkStream(AbstractIO):
+    """
+    Forward-only stream over an iterable of byte chunks, e.g. the inflated
+    payload of a .dat file produced chunk by chunk with iter_dat
+    """
+
+    def __init__(self, chunks: Iterable[bytes]):
+        super().__init__(_ChunkReader(chunks))
+
+    def get_widestr(self) -> str:
+        r = self._io
+        start = 0
+        while True:
+            buf = r._buf
+            off = r._off
+            end = _find_widestr_end(buf, off, off + start)
+            if end != -1:
+                r._off = end + 2
+                return self._decode_widestr(buf[off:end])
+            start = (len(buf) - off) & ~1
+            if not r._more():
+                r._off = len(r._buf)
+                return ''
+
+    def drain(self):
+        """
+        Consume the rest of the chunks, so the producer can run its
+        final checks (e.g. iter_dat verifies the content hash)
+        """
+        r = self._io
+        while r._more():
+            r._off = len(r._buf)
+
+    def _decompress(self, start: int, size: int, bufsize: int) -> bytes:
+        return zlib.decompress(self.get(size), bufsize=bufsize)
+
+
 class Buffer(AbstractIO):
+    # keystreams of cipher/decipher calls starting at offset 0 are taken
+    # from here, set a budget to enable it
+    keystream_cache = KeystreamCache()
 
     def set(self, io: BinaryIO):
         if self._io is not None:
@@ -216,8 +529,48 @@ class Buffer(AbstractIO):
         return Buffer(BytesIO(self.get(size)))
 
     def save(self, file: Union[str, bytes, int]):
-        with open(file, mode='wb') as f:
-            f.write(self._io.getvalue())
+        with open(file, mode='wb') as f, self._getbuffer() as view:
+            f.write(view)
+
+    def get_widestr(self) -> str:
+        if isinstance(self._io, BytesIO):
+            # getvalue would copy the whole buffer while a view of it
+            # is exported, read growing windows instead
+            return super().get_widestr()
+        pos = self._io.tell()
+        data = self._io
+        end = _find_widestr_end(data, pos, pos)
+        if end == -1:
+            self._io.seek(0, SEEK_END)
+            return ''
+        self._io.seek(end + 2)
+        return self._decode_widestr(data[pos:end])
+
+    def _get_chunk(self, size: int) -> memoryview:
+        pos = self._io.tell()
+        with self._getbuffer() as view:
+            result = view[pos:pos + size]
+        self._io.seek(size, SEEK_CUR)
+        return result
+
+    def get_view(self, kind: str, n: int) -> memoryview:
+        """
+        Zero-copy variant of get_array: a memoryview of the next n values
+        cast to kind. Values are in the native byte order, so the view is
+        only meaningful on little-endian hosts. A BytesIO-backed buffer can
+        not grow while the view is alive.
+        """
+        typecode, dtype = _array_types[kind]
+        pos = self._io.tell()
+        end = pos + n * array(typecode).itemsize
+        result = self._getbuffer()[pos:end].cast(typecode)
+        self._io.seek(end)
+        return result
+
+    def _getbuffer(self) -> memoryview:
+        if isinstance(self._io, BytesIO):
+            return self._io.getbuffer()
+        return memoryview(self._io)
 
     @staticmethod
     def _rand31pm(seed: int) -> int:
@@ -228,32 +581,57 @@ class Buffer(AbstractIO):
                 seed += 0x7fffffff
             yield seed - 1
 
-    def cipher(self, key: int, size: int = -1):
+    @staticmethod
+    def rand31pm_jump(seed: int, n: int) -> int:
+        """
+        State of the _rand31pm generator after n steps:
+        ``_rand31pm(rand31pm_jump(seed, n))`` continues the sequence
+        of ``_rand31pm(seed)`` from its n-th value
+        """
+        return jump(seed, n)
+
+    def _xor_keystream(self, view: memoryview, key: int,
+                       offset: int, workers: int):
+        cache = self.keystream_cache
+        if offset == 0 and 0 < len(view) <= cache.budget:
+            xor_bytes(view, cache.get(key, len(view)))
+        else:
+            xor_keystream(view, key, offset, workers)
+
+    def cipher(self, key: int, size: int = -1, *,
+               offset: int = 0, workers: int = 1):
+        """
+        offset: position of the current byte in the keystream, allows
+        to cipher any range of the payload
+        workers: number of threads processing the range in segments
+        """
         if size == -1:
             size = self.size() - self.pos()
-        gen = self._rand31pm(key)
         begin = self.pos()
         end = begin + size
-        view = self._io.getbuffer()
-        for i in range(begin, end):
-            view[i] = view[i] ^ (next(gen) & 255)
+        with self._getbuffer() as view:
+            self._xor_keystream(view[begin:end], key, offset, workers)
         self._io.seek(size, SEEK_CUR)
 
-    def decipher(self, key: int, size: int = -1):
+    def decipher(self, key: int, size: int = -1, *,
+                 offset: int = 0, workers: int = 1):
+        """
+        offset: position of the current byte in the keystream, allows
+        to decipher any range of the payload
+        workers: number of threads processing the range in segments
+        """
         if size == -1:
             size = self.size() - self.pos()
-        gen = self._rand31pm(key)
         begin = self.pos()
         end = begin + size
-        view = self._io.getbuffer()
-        for i in range(begin, end):
-            view[i] = view[i] ^ (next(gen) & 255)
+        with self._getbuffer() as view:
+            self._xor_keystream(view[begin:end], key, offset, workers)
         self._io.seek(begin, SEEK_SET)
 
     def _decompress(self, start: int, size: int, bufsize: int) -> bytes:
         end = start + size
-        result = zlib.decompress(self._io.getbuffer()[start:end],
-                                 bufsize=bufsize)
+        with self._getbuffer() as view:
+            result = zlib.decompress(view[start:end], bufsize=bufsize)
         self._io.seek(size, SEEK_CUR)
         return result
 
@@ -262,7 +640,8 @@ class Buffer(AbstractIO):
             size = self.size() - self.pos()
         begin = self.pos()
         end = begin + size
-        return zlib.crc32(self._io.getbuffer()[begin:end])
+        with self._getbuffer() as view:
+            return zlib.crc32(view[begin:end])
 
     @classmethod
     def from_file(cls, file: Union[str, bytes, int],
@@ -275,7 +654,33 @@ class Buffer(AbstractIO):
         return cls(BytesIO(b))
 
 
+class MappedBuffer(Buffer):
+    """
+    Buffer over a memory-mapped file, get_* calls, calc_hash and
+    decompress work on the mapping without copying the file.
+    The mapping is read-only unless copy_on_write is set: then it is
+    private, so cipher/decipher change the data in memory only.
+    """
+
+    @classmethod
+    def from_file(cls, file: Union[str, bytes, int],
+                  mode: str = 'rb', *,
+                  copy_on_write: bool = False) -> 'Buffer':
+        access = mmap.ACCESS_COPY if copy_on_write else mmap.ACCESS_READ
+        with open(file, mode) as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                # empty files can not be mapped
+                return Buffer(BytesIO())
+            return cls(mmap.mmap(f.fileno(), 0, access=access))
+
+
 class TypeStruct:
+    """
+    Record layout, compiled on first use into a plan: nested structs are
+    inlined, repeats expanded and consecutive fixed-size fields merged
+    into one precompiled struct.Struct, so a record is read or written
+    with one get/add call per run of fixed-size fields.
+    """
     _structs_cache = {}
     _io_map = {
         'bool': ('get_bool', 'add_bool'),
@@ -287,71 +692,158 @@ class TypeStruct:
         'double': ('get_double', 'add_double'),
         'widestr': ('get_widestr', 'add_widestr')
     }
+    _formats = {
+        'bool': 'B',
+        'byte': 'B',
+        'word': 'H',
+        'int': 'i',
+        'uint': 'I',
+        'single': 'f',
+        'double': 'd',
+    }
 
     def __init__(self, name: str, fields: tuple):
         self.ntuple_cls = namedtuple(name, tuple(f[0] for f in fields))
         self.types = tuple(f[1].strip() for f in fields)
+        self._plan = None
         TypeStruct._structs_cache[name] = self
 
-    def _get(self, absio: AbstractIO) -> NamedTuple:
-        result = []
-        for t in self.types:
-            if ':' in t:
-                field_type, num_repeat = t.split(':', 1)
-                num_repeat = int(num_repeat)
-            else:
-                field_type = t
-                num_repeat = 1
+    @staticmethod
+    def _parse_type(t: str):
+        if ':' in t:
+            field_type, num_repeat = t.split(':', 1)
+            return field_type.strip(), int(num_repeat)
+        return t, 1
 
+    def _leaves(self, leaves: list):
+        """
+        Append the flat sequence of primitive types of the record to leaves
+        and return a builder of the record from the flat values
+        """
+        start = len(leaves)
+        getters = []
+        plain = True
+        for t in self.types:
+            field_type, num_repeat = self._parse_type(t)
             if field_type in TypeStruct._io_map:
-                get_call = getattr(absio, TypeStruct._io_map[field_type][0])
-                if num_repeat > 1:
-                    subresult = []
-                    for i in range(num_repeat):
-                        subresult.append(get_call())
-                    result.append(tuple(subresult))
+                i = len(leaves)
+                leaves.extend([field_type] * num_repeat)
+                if field_type == 'bool':
+                    if num_repeat == 1:
+                        getters.append(lambda v, i=i: v[i] == 1)
+                    else:
+                        getters.append(lambda v, i=i, j=len(leaves):
+                                       tuple(x == 1 for x in v[i:j]))
+                    plain = False
+                elif num_repeat == 1:
+                    getters.append(lambda v, i=i: v[i])
                 else:
-                    for i in range(num_repeat):
-                        result.append(get_call())
+                    getters.append(lambda v, i=i, j=len(leaves):
+                                   tuple(v[i:j]))
+                    plain = False
             elif field_type in TypeStruct._structs_cache:
-                get_call = TypeStruct._structs_cache[field_type]._get
-                if num_repeat > 1:
-                    subresult = []
-                    for i in range(num_repeat):
-                        subresult.append(get_call())
-                    result.append(tuple(subresult))
+                sub = TypeStruct._structs_cache[field_type]
+                if num_repeat == 1:
+                    getters.append(sub._leaves(leaves))
                 else:
-                    for i in range(num_repeat):
-                        result.append(get_call())
+                    builders = [sub._leaves(leaves)
+                                for i in range(num_repeat)]
+                    getters.append(lambda v, builders=builders:
+                                   tuple(b(v) for b in builders))
+                plain = False
             else:
-                absio.close()
-                raise TypeError("TypeStruct.get: unknown type")
+                raise TypeError("TypeStruct: unknown type")
 
-        return self.ntuple_cls._make(result)
-
-    def _add(self, absio: AbstractIO, value: NamedTuple):
-        for v, t in zip(value, self.types):
-            if ':' in t:
-                field_type, num_repeat = t.split(':', 1)
-                num_repeat = int(num_repeat)
-            else:
-                field_type = t
-                num_repeat = 1
+        make = self.ntuple_cls._make
+        if plain:
+            end = len(leaves)
+            return lambda v: make(v[start:end])
+        return lambda v: make([g(v) for g in getters])
 
+    def _flattener(self):
+        """
+        Function appending the flat values of a record to a list
+        """
+        setters = []
+        for t in self.types:
+            field_type, num_repeat = self._parse_type(t)
             if field_type in TypeStruct._io_map:
-                add_call = getattr(absio, TypeStruct._io_map[field_type][1])
-                if num_repeat > 1:
-                    for i in range(num_repeat):
-                        add_call(v[i])
+                if field_type == 'bool':
+                    if num_repeat == 1:
+                        setters.append(lambda out, v: out.append(int(v)))
+                    else:
+                        setters.append(lambda out, v, n=num_repeat:
+                                       out.extend(int(x) for x in v[:n]))
+                elif num_repeat == 1:
+                    setters.append(list.append)
                 else:
-                    add_call(v)
+                    setters.append(lambda out, v, n=num_repeat:
+                                   out.extend(v[:n]))
             elif field_type in TypeStruct._structs_cache:
-                add_call = TypeStruct._structs_cache[field_type]._add
-                if num_repeat > 1:
-                    for i in range(num_repeat):
-                        add_call(v[i])
+                sub = TypeStruct._structs_cache[field_type]._flattener()
+                if num_repeat == 1:
+                    setters.append(sub)
                 else:
-                    add_call(v)
+                    def repeated(out, v, sub=sub, n=num_repeat):
+                        for i in range(n):
+                            sub(out, v[i])
+                    setters.append(repeated)
+            else:
+                raise TypeError("TypeStruct: unknown type")
+
+        def flatten(out, value):
+            for setter, v in zip(setters, value):
+                setter(out, v)
+        return flatten
+
+    def _compile(self):
+        leaves = []
+        build = self._leaves(leaves)
+        # runs of fixed-size fields become one Struct, None stands for widestr
+        steps = []
+        fmt = ''
+        for leaf in leaves:
+            if leaf == 'widestr':
+                if fmt:
+                    steps.append((Struct('<' + fmt), len(fmt)))
+                    fmt = ''
+                steps.append((None, 1))
             else:
+                fmt += TypeStruct._formats[leaf]
+        if fmt:
+            steps.append((Struct('<' + fmt), len(fmt)))
+        self._plan = (tuple(steps), build, self._flattener())
+
+    def _get_plan(self, absio: AbstractIO):
+        if self._plan is None:
+            try:
+                self._compile()
+            except TypeError:
                 absio.close()
-                raise TypeError("TypeStruct.add: unknown type")
+                raise
+        return self._plan
+
+    def _get(self, absio: AbstractIO) -> NamedTuple:
+        steps, build, flatten = self._get_plan(absio)
+        if len(steps) == 1 and steps[0][0] is not None:
+            st = steps[0][0]
+            return build(st.unpack(absio.get(st.size)))
+        values = []
+        for st, n in steps:
+            if st is None:
+                values.append(absio.get_widestr())
+            else:
+                values.extend(st.unpack(absio.get(st.size)))
+        return build(values)
+
+    def _add(self, absio: AbstractIO, value: NamedTuple):
+        steps, build, flatten = self._get_plan(absio)
+        values = []
+        flatten(values, value)
+        i = 0
+        for st, n in steps:
+            if st is None:
+                absio.add_widestr(values[i])
+            else:
+                absio.add(st.pack(*values[i:i + n]))
+            i += n
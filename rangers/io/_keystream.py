@@ -0,0 +1,205 @@
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+
+try:
+    import numpy as np
+except ImportError:  # numpy is optional
+    np = None
+
+# Park-Miller "minimal standard" generator used by Buffer._rand31pm:
+# state' = state * 16807 mod (2**31 - 1), computed with Schrage's method
+MODULUS = 0x7fffffff
+MULTIPLIER = 0x41a7
+
+BLOCK_SIZE = 1 << 16
+
+_powers = None
+_powers_np = None
+
+
+def _step(seed: int) -> int:
+    hi, lo = divmod(seed, 0x1f31d)
+    seed = lo * 0x41a7 - hi * 0xb14
+    if seed < 1:
+        seed += 0x7fffffff
+    return seed
+
+
+def _get_powers():
+    global _powers
+    if _powers is None:
+        powers = [1] * BLOCK_SIZE
+        for i in range(1, BLOCK_SIZE):
+            powers[i] = powers[i - 1] * MULTIPLIER % MODULUS
+        _powers = powers
+    return _powers
+
+
+def _get_powers_np():
+    global _powers_np
+    if _powers_np is None:
+        _powers_np = np.array(_get_powers(), dtype=np.uint64)
+    return _powers_np
+
+
+def _block(state: int, size: int) -> bytes:
+    """
+    Keystream bytes for states state, state * a, ..., state * a**(size-1)
+    """
+    if state == MODULUS:
+        # degenerate seed, the generator is stuck at zero
+        return bytes([(MODULUS - 1) & 255]) * size
+    if np is not None:
+        states = _get_powers_np()[:size] * np.uint64(state)
+        states %= np.uint64(MODULUS)
+        states -= np.uint64(1)
+        return states.astype(np.uint8).tobytes()
+    powers = _get_powers()
+    if size < BLOCK_SIZE:
+        powers = powers[:size]
+    return bytes([(state * p % MODULUS - 1) & 255 for p in powers])
+
+
+def jump(seed: int, n: int) -> int:
+    """
+    Generator state after n steps, computed in O(log n)
+    """
+    if n <= 2:
+        for i in range(n):
+            seed = _step(seed)
+        return seed
+    state = _step(_step(seed))
+    if state == MODULUS:
+        return state
+    return state * pow(MULTIPLIER, n - 2, MODULUS) % MODULUS
+
+
+def iter_keystream(seed: int, size: int, offset: int = 0):
+    """
+    Yield the byte stream of ``Buffer._rand31pm(seed)`` (lowest byte of every
+    value) starting from byte ``offset``, in blocks of at most BLOCK_SIZE bytes
+    """
+    state = jump(seed, offset)
+    head = []
+    # the first two states may be out of [1, MODULUS) for arbitrary seeds,
+    # after that the generator is a plain modular multiplication
+    while size > 0 and offset < 2:
+        state = _step(state)
+        head.append((state - 1) & 255)
+        offset += 1
+        size -= 1
+    if head:
+        yield bytes(head)
+
+    state = _step(state)
+    step = pow(MULTIPLIER, BLOCK_SIZE, MODULUS)
+    while size > 0:
+        n = min(size, BLOCK_SIZE)
+        yield _block(state, n)
+        size -= n
+        if state != MODULUS:
+            state = state * step % MODULUS
+
+
+def keystream(seed: int, size: int, offset: int = 0) -> bytes:
+    return b''.join(iter_keystream(seed, size, offset))
+
+
+def xor_bytes(view: memoryview, data: bytes):
+    """
+    XOR a writable byte memoryview in place with bytes of the same length
+    """
+    if np is not None:
+        target = np.frombuffer(view, dtype=np.uint8)
+        target ^= np.frombuffer(data, dtype=np.uint8)
+        return
+    value = int.from_bytes(view, 'little') ^ int.from_bytes(data, 'little')
+    view[:] = value.to_bytes(len(view), 'little')
+
+
+def _xor_segment(view: memoryview, seed: int, offset: int):
+    pos = 0
+    for block in iter_keystream(seed, len(view), offset):
+        end = pos + len(block)
+        xor_bytes(view[pos:end], block)
+        pos = end
+
+
+def xor_keystream(view: memoryview, seed: int, offset: int = 0,
+                  workers: int = 1):
+    """
+    XOR a writable byte memoryview in place with the keystream starting at
+    byte ``offset``. With ``workers`` > 1 the view is split into segments,
+    each one starts from its own jumped-ahead state and is processed on a
+    thread pool (this only scales when numpy is available, the pure-Python
+    path holds the GIL).
+    """
+    size = len(view)
+    if workers <= 1 or size <= BLOCK_SIZE:
+        _xor_segment(view, seed, offset)
+        return
+
+    segment = -(-size // workers)
+    segment = -(-segment // BLOCK_SIZE) * BLOCK_SIZE
+    with ThreadPoolExecutor(workers) as executor:
+        futures = [executor.submit(_xor_segment,
+                                   view[begin:begin + segment],
+                                   seed, offset + begin)
+                   for begin in range(0, size, segment)]
+        for future in futures:
+            future.result()
+
+
+class KeystreamCache:
+    """
+    Bounded LRU cache of keystream prefixes keyed by (seed, length).
+    budget: memory budget in bytes, 0 disables the cache
+    """
+
+    def __init__(self, budget: int = 0):
+        self.budget = budget
+        self.hits = 0
+        self.misses = 0
+        self._size = 0
+        self._entries = OrderedDict()
+        self._lock = Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key) -> bool:
+        return key in self._entries
+
+    @property
+    def size(self) -> int:
+        """Memory used by the cached keystreams in bytes"""
+        return self._size
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+            self.hits = 0
+            self.misses = 0
+
+    def get(self, seed: int, size: int) -> bytes:
+        key = (seed, size)
+        with self._lock:
+            result = self._entries.get(key)
+            if result is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return result
+            self.misses += 1
+
+        result = keystream(seed, size)
+
+        with self._lock:
+            if size <= self.budget and key not in self._entries:
+                self._entries[key] = result
+                self._size += size
+                while self._size > self.budget:
+                    _, evicted = self._entries.popitem(last=False)
+                    self._size -= len(evicted)
+        return result
@@ -6,7 +6,7 @@ from enum import IntEnum
 from collections import namedtuple
 from typing import List
 
-from rangers.io import AbstractIO, Stream, Buffer
+from rangers.io import AbstractIO, Buffer, MappedBuffer
 from rangers.blockpar import BlockPar
 
 
@@ -38,6 +38,16 @@ def set_kind(e, compressed: bool):
     else:
         return e & ((1 << 31) - 1)
 
+def get_array_kind(kind):
+    return {
+        StorageKind.INT32: 'int',
+        StorageKind.DWORD: 'uint',
+        StorageKind.BYTE: 'byte',
+        StorageKind.FLOAT: 'single',
+        StorageKind.DOUBLE: 'double',
+        StorageKind.WCHAR: 'word',
+    }[kind]
+
 def get_size_by_kind(kind):
     if kind is StorageKind.DOUBLE:
         return 8
@@ -103,6 +113,16 @@ class DataTable:
     def get_widestr(self, i: int) -> str:
         return self.entries[i].decode('utf-16le')
 
+    def get_array(self, i: int, kind: str, *, numpy: bool = False):
+        """
+        kind: primitive type of the elements, see AbstractIO.get_array
+        """
+        buf = self.get_buf(i)
+        result = buf.get_array(kind, len(self.entries[i]) // self._el_size,
+                               numpy=numpy)
+        buf.close()
+        return result
+
 
 class StorageItem:
 
@@ -114,6 +134,10 @@ class StorageItem:
     def get(self) -> DataTable:
         return self.datatable
 
+    def get_array(self, i: int, *, numpy: bool = False):
+        return self.datatable.get_array(i, get_array_kind(self.kind),
+                                        numpy=numpy)
+
     def load(self, s: AbstractIO):
         self.name = s.get_widestr()
         self.kind, compressed = get_kind(s.get_uint())
@@ -210,6 +234,6 @@ class Storage:
     @classmethod
     def from_file(cls, path: str) -> 'Storage':
         storage = cls()
-        with Stream.from_file(path, 'rb') as s:
+        with MappedBuffer.from_file(path) as s:
             storage.load(s)
         return storage